@@ -1,14 +1,1532 @@
 import json
+import hashlib
 import requests
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageChops, ImageColor
+from PIL.PngImagePlugin import PngInfo
 import io
 import os
-from concurrent.futures import ThreadPoolExecutor
+import mmap
+import tempfile
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import math
-from threading import Lock
-import queue
+import random
+from threading import Lock, RLock, Condition, local, get_ident
 import time
-from concurrent.futures import wait
+import sys
+from concurrent.futures import Future, as_completed
+from collections import OrderedDict
+from bisect import bisect_right
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 各平台的字体搜索路径，按顺序查找
+if os.name == 'nt':
+    DEFAULT_FONT_SEARCH_PATHS = ['assets/fonts', os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')]
+elif sys.platform == 'darwin':
+    DEFAULT_FONT_SEARCH_PATHS = ['assets/fonts', '/System/Library/Fonts', '/Library/Fonts']
+else:
+    DEFAULT_FONT_SEARCH_PATHS = [
+        'assets/fonts',
+        '/usr/share/fonts/opentype/noto',
+        '/usr/share/fonts/noto-cjk',
+        '/usr/share/fonts/google-noto-cjk',
+        '/usr/share/fonts/truetype/noto',
+    ]
+
+class FontRegistry:
+    """进程级字体缓存，按(路径, 字号, index)缓存ImageFont实例，所有生成器共享"""
+    _fonts = {}
+    _lock = Lock()
+    search_paths = list(DEFAULT_FONT_SEARCH_PATHS)
+
+    @classmethod
+    def configure(cls, search_paths):
+        """设置字体搜索路径，并清空已缓存的字体"""
+        with cls._lock:
+            cls.search_paths = list(search_paths)
+            cls._fonts.clear()
+
+    @classmethod
+    def resolve(cls, name):
+        """查找字体文件：已存在的路径直接使用，否则按文件名在搜索路径中查找"""
+        if os.path.exists(name):
+            return name
+        file_name = os.path.basename(name)
+        for search_path in cls.search_paths:
+            candidate = os.path.join(search_path, file_name)
+            if os.path.exists(candidate):
+                return candidate
+        raise OSError(f"Font not found: {name}")
+
+    @classmethod
+    def get(cls, name, size, index=0):
+        """获取字体实例，首次使用时才加载"""
+        key = (name, size, index)
+        font = cls._fonts.get(key)
+        if font is not None:
+            return font
+        with cls._lock:
+            font = cls._fonts.get(key)
+            if font is None:
+                font = ImageFont.truetype(cls.resolve(name), size, index=index)
+                cls._fonts[key] = font
+            return font
+
+class IconAtlas:
+    """预缩放的等级/难度图标，转换好的贴图和蒙版在所有生成器之间共享"""
+    _atlases = {}
+    _lock = Lock()
+
+    def __init__(self, rank_images, difficulty_images, rank_size, diff_size):
+        # 分数阈值升序排列，配合bisect查找等级
+        self.rank_thresholds = sorted(rank_images)
+        self.rank_sprites = [self._prepare(rank_images[threshold], rank_size) for threshold in self.rank_thresholds]
+        self.difficulty_sprites = {name: self._prepare(img, diff_size) for name, img in difficulty_images.items()}
+
+    @staticmethod
+    def _prepare(image, size):
+        """缩放图标，并拆分为RGB贴图和alpha蒙版（非RGBA图片不使用蒙版）"""
+        resized = image.resize(size)
+        if resized.mode == 'RGBA':
+            return resized.convert('RGB'), resized.getchannel('A')
+        return resized.convert('RGB'), None
+
+    @classmethod
+    def get(cls, rank_images, difficulty_images, rank_size, diff_size, signature=None):
+        """获取指定尺寸的图标集，首次使用时创建；signature为资源包签名，图标文件变化后重新创建"""
+        key = (signature, rank_size, diff_size)
+        atlas = cls._atlases.get(key)
+        if atlas is None:
+            with cls._lock:
+                atlas = cls._atlases.get(key)
+                if atlas is None:
+                    atlas = cls(rank_images, difficulty_images, rank_size, diff_size)
+                    cls._atlases[key] = atlas
+        return atlas
+
+    def rank_sprite(self, score):
+        """获取对应分数的等级贴图(sprite, mask)，低于所有阈值时使用最低等级"""
+        if not self.rank_sprites:
+            return None
+        index = max(bisect_right(self.rank_thresholds, score) - 1, 0)
+        return self.rank_sprites[index]
+
+    def difficulty_sprite(self, diff_name):
+        """获取难度贴图(sprite, mask)"""
+        return self.difficulty_sprites.get(diff_name)
+
+class GlyphAtlas:
+    """
+    分数和rating文字的字形图集：这些文字只用到很小的字符集，每种字体只光栅化一次，
+    绘制时按字体的步进和字距拼接缓存的字形（重叠部分取最大值，与FreeType整串绘制一致）。
+    包含字符集以外字符的文字由调用方改用draw.text
+    """
+    ALPHABET = "0123456789,.-> Base:"
+    # 创建时用这些文字与draw.text逐像素比较，不一致（如字体含连字）时停用图集
+    SELF_CHECK = ("1,009,545", "Base: 15.8 -> 16.98", "Base: 10.0 -> 12.02")
+    _atlases = {}
+    _lock = Lock()
+
+    def __init__(self, font):
+        self.glyphs = {}  # 字符 -> (x偏移, y偏移, 字形蒙版数组)，空白字符为None
+        self.advances = {}  # 字符 -> 步进(1/64像素)
+        for char in self.ALPHABET:
+            self.advances[char] = round(font.getlength(char) * 64)
+            left, top, right, bottom = font.getbbox(char)
+            if right <= left or bottom <= top:
+                self.glyphs[char] = None
+                continue
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+            self.glyphs[char] = (left, top, np.asarray(mask))
+        # 字距：两个字符连写的长度与各自步进之和的差
+        self.kerning = {}
+        for first in self.ALPHABET:
+            for second in self.ALPHABET:
+                kerning = round(font.getlength(first + second) * 64) - self.advances[first] - self.advances[second]
+                if kerning:
+                    self.kerning[first, second] = kerning
+        self.enabled = all(self._matches_draw_text(font, text) for text in self.SELF_CHECK)
+
+    def _matches_draw_text(self, font, text):
+        expected = Image.new('L', (font.size * len(text), font.size * 3), 0)
+        ImageDraw.Draw(expected).text((0, font.size), text, font=font, fill=255)
+        actual = Image.new('L', expected.size, 0)
+        self.enabled = True
+        self.draw_text(actual, (0, font.size), text, 255)
+        return ImageChops.difference(expected, actual).getbbox() is None
+
+    @classmethod
+    def get(cls, font):
+        """获取字体对应的图集，首次使用时创建；不是FreeType字体时返回None"""
+        path = getattr(font, 'path', None)
+        if path is None:
+            return None
+        key = (path, font.size, getattr(font, 'index', 0), getattr(font, 'layout_engine', None))
+        atlas = cls._atlases.get(key)
+        if atlas is None:
+            with cls._lock:
+                atlas = cls._atlases.get(key)
+                if atlas is None:
+                    atlas = cls(font)
+                    cls._atlases[key] = atlas
+        return atlas
+
+    def draw_text(self, image, xy, text, fill):
+        """在image上绘制文字，文字包含字符集以外的字符或图集已停用时返回False"""
+        if not self.enabled or any(char not in self.advances for char in text):
+            return False
+        
+        # 计算每个字形的位置，笔位置按1/64像素累加，取整方式与FreeType绘制一致
+        pen = 0
+        placed = []
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self.kerning.get((previous, char), 0)
+            glyph = self.glyphs[char]
+            if glyph is not None:
+                left, top, mask = glyph
+                placed.append((((pen + 32) >> 6) + left, top, mask))
+            pen += self.advances[char]
+            previous = char
+        if not placed:
+            return True
+        
+        x0 = min(x for x, _, _ in placed)
+        y0 = min(y for _, y, _ in placed)
+        x1 = max(x + mask.shape[1] for x, _, mask in placed)
+        y1 = max(y + mask.shape[0] for _, y, mask in placed)
+        combined = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        for x, y, mask in placed:
+            region = combined[y - y0:y - y0 + mask.shape[0], x - x0:x - x0 + mask.shape[1]]
+            np.maximum(region, mask, out=region)
+        
+        if isinstance(fill, str):
+            fill = ImageColor.getcolor(fill, image.mode)
+        box = (xy[0] + x0, xy[1] + y0, xy[0] + x1, xy[1] + y1)
+        image.paste(fill, box, Image.fromarray(combined, 'L'))
+        return True
+
+# 资源包版本号，资源文件的组成变化后需要递增，提示重新运行fetch()
+ASSET_BUNDLE_VERSION = 1
+
+class AssetBundle:
+    """
+    本地资源包：难度图标、等级图标和清单文件，首次使用时才从磁盘加载，默认不访问网络。
+    缺失的资源使用空白图片代替，需要显式调用fetch()下载，清单中记录每个难度图标下载时的资源包版本
+    """
+    DIFFICULTY_TYPES = ["basic", "advanced", "expert", "master", "lunatic"]
+    DIFFICULTY_URL = "https://u.otogame.net/img/ongeki/diff_{name}.png"
+    FALLBACK_URL = "https://u.otogame.net/img/ongeki/musicjacket_fallback.webp"
+    # 等级对应关系
+    RANK_MAP = {
+        1007500: 'sssplus',
+        1000000: 'sss',
+        990000: 'ss',
+        970000: 's',
+        940000: 'aaa',
+        900000: 'aa',
+        850000: 'a',
+        800000: 'bbb',
+        750000: 'bb',
+        700000: 'b',
+        500000: 'c',
+        0: 'd'
+    }
+
+    def __init__(self, root='assets'):
+        self.root = root
+        self.lock = RLock()  # 加载函数中可能用到其他资源
+        self._loaded = {}
+
+    def _get(self, name, loader):
+        with self.lock:
+            if name not in self._loaded:
+                self._loaded[name] = loader()
+            return self._loaded[name]
+
+    def difficulty_path(self, diff_type):
+        return os.path.join(self.root, f'diff_{diff_type}.png')
+
+    def rank_path(self, rank):
+        return os.path.join(self.root, 'ranks', f'score_tr_{rank}.png')
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, 'bundle.json')
+
+    @property
+    def manifest(self):
+        """清单文件内容，不存在时为空"""
+        def load():
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return {}
+        return self._get('manifest', load)
+
+    def difficulty_version(self, diff_type):
+        """
+        难度图标下载时的资源包版本，图标不存在时为0。
+        清单中没有记录的图标（没有清单或手动放入的文件）能正常打开时视为当前版本，不重新下载
+        """
+        image_path = self.difficulty_path(diff_type)
+        if not os.path.exists(image_path):
+            return 0
+        versions = self.manifest.get('difficulty')
+        if isinstance(versions, dict):
+            version = versions.get(diff_type)
+        else:
+            version = self.manifest.get('version')  # 旧格式的清单只有整体版本号
+        if version is None:
+            try:
+                with Image.open(image_path) as img:
+                    img.verify()
+            except Exception:
+                return 0
+            return ASSET_BUNDLE_VERSION
+        return version
+
+    @property
+    def outdated(self):
+        """缺失或由旧版本下载的难度图标，fetch()时下载"""
+        return [diff_type for diff_type in self.DIFFICULTY_TYPES if self.difficulty_version(diff_type) != ASSET_BUNDLE_VERSION]
+
+    def needs_fetch(self, jacket_store=None):
+        """是否有需要fetch()处理的资源：缺失或过期的难度图标、清单文件、jacket_store中的默认封面"""
+        if self.outdated or not self.manifest:
+            return True
+        return jacket_store is not None and 'fallback' not in jacket_store
+
+    @property
+    def difficulty_images(self):
+        """难度指示器图片，缺失的使用空白图片"""
+        return self._get('difficulty_images', self._load_difficulty_images)
+
+    def _load_difficulty_images(self):
+        difficulty_images = {}
+        missing = []
+        for diff_type in self.DIFFICULTY_TYPES:
+            image_path = self.difficulty_path(diff_type)
+            try:
+                with Image.open(image_path) as img:
+                    img.load()
+                difficulty_images[diff_type] = img
+            except OSError:
+                missing.append(diff_type)
+                difficulty_images[diff_type] = Image.new('RGBA', (116, 15), (0, 0, 0, 0))
+        if missing:
+            print(f"Warning: Difficulty images not found: {', '.join(missing)}; run fetch() to download them")
+        elif self.outdated:
+            print(f"Warning: Difficulty images {', '.join(self.outdated)} are older than asset bundle version "
+                  f"{ASSET_BUNDLE_VERSION}; run fetch() to update them")
+        return difficulty_images
+
+    @property
+    def rank_images(self):
+        """等级图标，{分数阈值: 图片}"""
+        return self._get('rank_images', self._load_rank_images)
+
+    def _load_rank_images(self):
+        rank_images = {}
+        for score, rank in self.RANK_MAP.items():
+            image_path = self.rank_path(rank)
+            try:
+                if os.path.exists(image_path):
+                    with Image.open(image_path) as img:
+                        img.load()
+                    rank_images[score] = img
+                else:
+                    print(f"Warning: Rank image not found: {image_path}")
+            except Exception as e:
+                print(f"Error loading rank image {rank}: {e}")
+        return rank_images
+
+    @property
+    def rank_thresholds(self):
+        """等级图标的分数阈值，降序排列"""
+        return self._get('rank_thresholds', lambda: sorted(self.rank_images, reverse=True))
+
+    @property
+    def signature(self):
+        """资源包签名：版本号和所有图标文件的修改时间、大小，用于使图标和图块缓存失效"""
+        def compute():
+            paths = [self.difficulty_path(diff_type) for diff_type in self.DIFFICULTY_TYPES]
+            paths += [self.rank_path(rank) for rank in self.RANK_MAP.values()]
+            content = [ASSET_BUNDLE_VERSION] + [(path, JacketTileCache.source_signature(path)) for path in paths]
+            return hashlib.sha1(repr(content).encode('utf-8')).hexdigest()[:16]
+        return self._get('signature', compute)
+
+    def fetch(self, jacket_store=None, timeout=10):
+        """
+        显式下载缺失的资源（难度图标，以及jacket_store中缺失的默认封面），
+        只下载缺失或由旧版本下载的难度图标，并在清单中记录每个图标的版本。返回下载的资源名列表
+        """
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        fetched = []
+        headers = {"Referer": "https://u.otogame.net/"}
+        versions = {diff_type: self.difficulty_version(diff_type) for diff_type in self.DIFFICULTY_TYPES}
+        for diff_type in self.outdated:
+            image_path = self.difficulty_path(diff_type)
+            try:
+                response = requests.get(self.DIFFICULTY_URL.format(name=diff_type), timeout=timeout)
+                response.raise_for_status()
+                Image.open(io.BytesIO(response.content))  # 确认是有效的图片
+                write_file_atomic(image_path, response.content)
+                versions[diff_type] = ASSET_BUNDLE_VERSION
+                fetched.append(f'diff_{diff_type}')
+                print(f"Downloaded and saved {diff_type} difficulty image")
+            except Exception as e:
+                # 下载失败的图标保留原来的版本号，下次继续更新
+                print(f"Error downloading {diff_type} difficulty image: {e}")
+        
+        if jacket_store is not None and 'fallback' not in jacket_store:
+            try:
+                response = requests.get(self.FALLBACK_URL, headers=headers, timeout=timeout)
+                response.raise_for_status()
+                Image.open(io.BytesIO(response.content))
+                jacket_store.append('fallback', response.content)
+                fetched.append('fallback')
+            except Exception as e:
+                print(f"Error downloading fallback jacket: {e}")
+        
+        manifest = {
+            'version': ASSET_BUNDLE_VERSION,
+            'difficulty': {diff_type: version for diff_type, version in versions.items()
+                           if os.path.exists(self.difficulty_path(diff_type))},
+            'ranks': [rank for rank in self.RANK_MAP.values() if os.path.exists(self.rank_path(rank))],
+        }
+        write_file_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        
+        # 下次使用时重新加载
+        with self.lock:
+            self._loaded.clear()
+        return fetched
+
+_default_asset_bundle = None
+
+def get_default_asset_bundle():
+    """进程级共享的资源包"""
+    global _default_asset_bundle
+    if _default_asset_bundle is None:
+        _default_asset_bundle = AssetBundle()
+    return _default_asset_bundle
+
+# 模板版本号，修改单元格背景的绘制方式后需要递增，使旧的缓存失效
+# 2: 单元格背景中包含半透明遮罩
+TEMPLATE_VERSION = 2
+
+# 图像布局：尺寸均为完整分辨率下的像素，渲染时按缩放比例换算
+# columns: 每行的歌曲数
+# sections: 区段标题、数据来源（data下的列表，多个列表时合并去重后重新排序）、
+#           区段rating字段（None为不显示）、最多显示的歌曲数（None为全部）
+LAYOUTS = {
+    'b55': {
+        'columns': 5,
+        'sections': (
+            {'title': 'BEST', 'source': 'best_rating_list', 'rating': 'best_rating', 'limit': 30},
+            {'title': 'NEW', 'source': 'best_new_rating_list', 'rating': 'best_new_rating', 'limit': 15},
+            {'title': 'RECENT', 'source': 'hot_rating_list', 'rating': 'hot_rating', 'limit': 10},
+        ),
+        'section_padding': 60,  # 原30*2
+        'title_x': 40,  # 原20*2
+        'title_spacing': 10,  # 标题与单元格之间的间距
+        'bottom_padding': 40,
+    },
+    # 所有游玩记录：全部谱面按rating排序铺满一个区段
+    'records': {
+        'columns': 8,
+        'sections': (
+            {'title': 'RECORDS', 'source': ('best_rating_list', 'best_new_rating_list', 'hot_rating_list'),
+             'rating': None, 'limit': None},
+        ),
+        'section_padding': 60,
+        'title_x': 40,
+        'title_spacing': 10,
+        'bottom_padding': 40,
+    },
+}
+
+def atomic_temp_path(path):
+    """与path同目录的临时文件名，包含进程号和线程号，同时写入同一路径的多个进程和线程不会互相覆盖"""
+    return f"{path}.{os.getpid()}-{get_ident()}.tmp"
+
+def write_file_atomic(path, data):
+    """
+    先写临时文件再重命名，避免并发读取或中途出错时留下不完整的文件。
+    多个写入者同时写入同一路径时，读取方看到的总是某一个写入者的完整内容
+    """
+    tmp_path = atomic_temp_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class FileLock:
+    """
+    跨进程的独占文件锁（POSIX使用flock，Windows使用msvcrt.locking），不可重入。
+    同一进程内的多个线程各自打开锁文件，同样互斥
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return self
+
+    def __exit__(self, *exc_info):
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+class ImageLRU:
+    """按key缓存生成好的图层，超过数量上限时淘汰最久未使用的"""
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get_or_build(self, key, builder):
+        with self.lock:
+            image = self.items.get(key)
+            if image is not None:
+                self.items.move_to_end(key)
+                return image
+        image = builder()
+        with self.lock:
+            self.items[key] = image
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return image
+
+class DiskImageStore:
+    """
+    磁盘缓存目录，多个进程可以同时使用同一个目录：
+    写入时先写唯一的临时文件再重命名（无锁发布，读取方只会看到完整的文件），
+    读取时更新文件时间，作为最近使用时间；
+    估计的占用超出上限，或本进程写入的数据累计到一定量时，持有目录锁重新扫描整个目录，
+    按最近使用时间淘汰到上限以下，其他进程写入的文件同样计入
+    extensions: 目录中属于缓存的文件扩展名
+    """
+    LOCK_FILE = '.lock'
+    # 自动淘汰时淘汰到上限的这个比例以下，避免之后每次写入都重新扫描
+    EVICT_TARGET = 0.9
+    # 超过这个时间(秒)的临时文件视为写入者已经退出，清理时删除
+    STALE_TMP_AGE = 3600
+
+    def __init__(self, cache_dir, max_bytes, extensions=('.png',)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extensions = tuple(extensions)
+        self.estimated_bytes = None  # 上次扫描时的占用加上之后本进程写入的字节数，首次写入时扫描
+        self.unchecked_bytes = 0  # 上次扫描之后本进程写入的字节数
+        self.lock = Lock()
+
+    def _path(self, file_name):
+        return os.path.join(self.cache_dir, file_name)
+
+    def _touch(self, file_path):
+        """更新访问时间，用于LRU淘汰；文件可能刚被其他进程淘汰"""
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+    def scan(self):
+        """扫描目录，返回[(最近使用时间, 大小, 文件名)]，不包括临时文件和锁文件"""
+        entries = []
+        try:
+            iterator = os.scandir(self.cache_dir)
+        except FileNotFoundError:
+            return entries
+        with iterator:
+            for entry in iterator:
+                if not entry.name.endswith(self.extensions):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue  # 已被其他进程删除
+                entries.append((stat.st_mtime, stat.st_size, entry.name))
+        return entries
+
+    def load(self, file_name, signature=None):
+        """读取缓存的图片，不存在、读取失败或保存时的签名与signature不同时返回None"""
+        file_path = self._path(file_name)
+        try:
+            with Image.open(file_path) as img:
+                if signature is not None and img.info.get('signature') != signature:
+                    return None
+                image = img.convert('RGB')
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: Failed to load cached tile {file_name}: {e}")
+            return None
+        self._touch(file_path)
+        return image
+
+    def save(self, file_name, image, signature=None):
+        """写入图片，signature不为空时保存在PNG的文本块中，同名的旧版本被直接替换"""
+        buffer = io.BytesIO()
+        options = {}
+        if signature is not None:
+            options['pnginfo'] = PngInfo()
+            options['pnginfo'].add_text('signature', signature)
+        try:
+            image.save(buffer, format='PNG', compress_level=1, **options)
+        except Exception as e:
+            print(f"Warning: Failed to save cached tile {file_name}: {e}")
+            return
+        self.write_bytes(file_name, buffer.getvalue())
+
+    def read_bytes(self, file_name):
+        """读取缓存文件的原始内容，不存在时返回None"""
+        file_path = self._path(file_name)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(file_path)
+        return data
+
+    def write_bytes(self, file_name, data):
+        """写入原始内容"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_file_atomic(self._path(file_name), data)
+        except OSError as e:
+            print(f"Warning: Failed to save cache file {file_name}: {e}")
+            return
+        
+        with self.lock:
+            self.unchecked_bytes += len(data)
+            if self.estimated_bytes is not None:
+                self.estimated_bytes += len(data)
+            needs_scan = (self.estimated_bytes is None or self.estimated_bytes > self.max_bytes
+                          or self.unchecked_bytes > self.max_bytes * (1 - self.EVICT_TARGET))
+        if needs_scan:
+            try:
+                self.evict()
+            except OSError as e:
+                print(f"Warning: Failed to evict cache files in {self.cache_dir}: {e}")
+
+    def _remove_file(self, file_name):
+        """删除缓存文件，文件已不存在（被其他进程删除）时返回False"""
+        try:
+            os.remove(self._path(file_name))
+            return True
+        except OSError:
+            return False
+
+    def _evict_locked(self, limit, target):
+        """持有目录锁时调用：占用超出limit时按最近使用时间淘汰到target以下"""
+        entries = self.scan()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        freed = 0
+        if total > limit:
+            for _, size, file_name in sorted(entries):
+                if total <= target:
+                    break
+                if self._remove_file(file_name):
+                    removed += 1
+                    freed += size
+                total -= size
+        with self.lock:
+            self.estimated_bytes = total
+            self.unchecked_bytes = 0
+        return {'files': len(entries) - removed, 'bytes': total, 'removed': removed, 'freed': freed}
+
+    def evict(self):
+        """持有目录锁重新扫描整个目录，占用超出上限时按最近使用时间淘汰"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with FileLock(self._path(self.LOCK_FILE)):
+            return self._evict_locked(self.max_bytes, self.max_bytes * self.EVICT_TARGET)
+
+    def prune(self, max_bytes=None, tmp_age=None):
+        """
+        清理目录：删除残留的临时文件，并按最近使用时间淘汰到max_bytes(默认为容量上限)以下，0为清空。
+        返回{'files', 'bytes', 'removed', 'freed'}
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        tmp_age = self.STALE_TMP_AGE if tmp_age is None else tmp_age
+        if not os.path.isdir(self.cache_dir):
+            return {'files': 0, 'bytes': 0, 'removed': 0, 'freed': 0}
+        
+        with FileLock(self._path(self.LOCK_FILE)):
+            cutoff = time.time() - tmp_age
+            stale_count = 0
+            stale_bytes = 0
+            with os.scandir(self.cache_dir) as iterator:
+                for entry in iterator:
+                    if not entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                        if stat.st_mtime < cutoff:
+                            os.remove(entry.path)
+                            stale_count += 1
+                            stale_bytes += stat.st_size
+                    except OSError:
+                        pass
+            result = self._evict_locked(max_bytes, max_bytes)
+        result['removed'] += stale_count
+        result['freed'] += stale_bytes
+        return result
+
+    def stats(self):
+        """目录的当前占用：{'files', 'bytes', 'max_bytes', 'oldest', 'newest'}，时间为最近使用时间"""
+        entries = self.scan()
+        return {
+            'files': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'oldest': min(entries)[0] if entries else None,
+            'newest': max(entries)[0] if entries else None,
+        }
+
+class JacketTileCache:
+    """
+    已模糊、已裁剪的单元格背景缓存（内存 + 磁盘）。
+    缓存键为(music_id, 单元格尺寸, 模糊半径, 模板版本)，每个键一个文件，
+    文件中记录源封面的签名，封面变化后自动失效，重新生成时直接替换旧文件。
+    内存和磁盘均按LRU淘汰。
+    """
+    def __init__(self, cache_dir='cache/tiles', max_memory_items=256, max_disk_bytes=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_items = max_memory_items
+        self.memory = OrderedDict()  # key -> (source_signature, image)
+        self.disk = DiskImageStore(cache_dir, max_disk_bytes)
+        self.lock = Lock()
+
+    @staticmethod
+    def source_signature(source_path):
+        """源文件的签名，文件不存在时为'none'"""
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return 'none'
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    @staticmethod
+    def _file_name(key):
+        music_id, (width, height), blur_radius, version = key
+        return f"{music_id}_{width}x{height}_b{blur_radius}_v{version}.png"
+
+    def _remember(self, key, signature, image):
+        self.memory[key] = (signature, image)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key, signature):
+        """获取缓存的背景图，未命中或源封面签名已变化时返回None"""
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None:
+                if cached[0] == signature:
+                    self.memory.move_to_end(key)
+                    return cached[1]
+                del self.memory[key]
+        
+        image = self.disk.load(self._file_name(key), signature)
+        if image is not None:
+            with self.lock:
+                self._remember(key, signature, image)
+        return image
+
+    def put(self, key, signature, image):
+        """写入缓存，替换同一键下已失效的旧文件"""
+        with self.lock:
+            self._remember(key, signature, image)
+        self.disk.save(self._file_name(key), image, signature)
+
+class JacketImageCache:
+    """
+    已解码、已缩放到单元格封面尺寸的封面缓存。
+    写入时完整解码并缩放，不保留打开的文件；按像素字节数限制总大小，超出时淘汰最久未使用的
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> image
+        self.total_bytes = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, builder):
+        """获取缓存的封面，未命中时调用builder生成；builder返回None时不缓存"""
+        with self.lock:
+            image = self.items.get(key)
+            if image is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+        
+        image = builder()
+        if image is None:
+            return None
+        with self.lock:
+            previous = self.items.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= CellTileCache.image_bytes(previous)
+            self.items[key] = image
+            self.total_bytes += CellTileCache.image_bytes(image)
+            while self.total_bytes > self.max_bytes and self.items:
+                _, evicted = self.items.popitem(last=False)
+                self.total_bytes -= CellTileCache.image_bytes(evicted)
+                self.evictions += 1
+        return image
+
+    def stats(self):
+        with self.lock:
+            return {
+                'items': len(self.items),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class CellTileCache:
+    """
+    渲染完成的单元格图块缓存，按内容寻址：
+    键为封面、难度、分数、rating、图块尺寸和模板的哈希，与格子所在的位置、区段和玩家无关，
+    相同的格子只需渲染一次。内存按图块字节数限制，cache_dir不为空时同时缓存到磁盘
+    """
+    def __init__(self, max_memory_bytes=96 * 1024 * 1024, cache_dir=None, max_disk_bytes=128 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()  # key -> image
+        self.memory_bytes = 0
+        self.disk = DiskImageStore(cache_dir, max_disk_bytes) if cache_dir else None
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def image_bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def _remember(self, key, image):
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= self.image_bytes(previous)
+        self.memory[key] = image
+        self.memory_bytes += self.image_bytes(image)
+        while self.memory_bytes > self.max_memory_bytes and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= self.image_bytes(evicted)
+
+    def get(self, key):
+        """获取缓存的图块，未命中时返回None。返回的图块是共享的，不要修改"""
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return image
+        
+        image = self.disk.load(f"{key}.png") if self.disk else None
+        with self.lock:
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, image)
+        return image
+
+    def put(self, key, image):
+        with self.lock:
+            self._remember(key, image)
+        if self.disk:
+            self.disk.save(f"{key}.png", image)
+
+class RenderCache:
+    """
+    整张图的渲染结果缓存：按输入数据和渲染参数的哈希保存编码后的图片，
+    数据没有变化时直接返回，不再渲染和编码。磁盘占用超出上限时按最近使用时间淘汰
+    """
+    def __init__(self, cache_dir='cache/renders', max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        extensions = tuple('.' + ('jpg' if fmt == 'jpeg' else fmt) for fmt in OUTPUT_FORMATS)
+        self.store = DiskImageStore(cache_dir, max_bytes, extensions)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _file_name(key, fmt):
+        return f"{key}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+    def get(self, key, fmt):
+        """获取缓存的编码结果，未命中时返回None"""
+        data = self.store.read_bytes(self._file_name(key, fmt))
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key, fmt, data):
+        self.store.write_bytes(self._file_name(key, fmt), data)
+
+JACKET_PACK_PATH = 'assets/covers.pack'
+
+class JacketPack:
+    """
+    单文件封面包：所有封面的原始webp数据顺序追加到同一个文件中。
+    文件格式：文件头 + 若干条记录，每条记录为(标记, key长度, 数据长度, crc32) + key + 数据，
+    同一key的后写入记录覆盖之前的记录。
+    打开时扫描一次建立内存索引，查找无需访问文件系统；其他进程新追加的记录在refresh()后可见
+    （生成器在每批渲染和预取开始时调用一次），读取通过mmap进行并校验crc32，校验失败的记录从索引中移除。
+    每条记录在文件锁内以单次O_APPEND写入，多个进程同时追加也不会交错。
+    扫描遇到损坏的记录时跳到下一条完整且校验通过的记录；文件末尾写入中断留下的半条记录在文件锁内截断
+    """
+    MAGIC = b'B55JPK1\n'
+    RECORD_MARK = b'JR'
+    RECORD = struct.Struct('<2sHII')
+
+    def __init__(self, path=JACKET_PACK_PATH, import_dir='assets/cover'):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.lock = Lock()
+        self.index = {}  # key -> (数据偏移, 数据长度, crc32)
+        self.scanned = 0
+        self.map = None
+        
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+        self.file = open(path, 'rb')
+        
+        created = False
+        if os.fstat(self.fd).st_size < len(self.MAGIC):
+            # 多个进程同时新建封面包时，只有一个进程写入文件头
+            with FileLock(self.lock_path):
+                if os.fstat(self.fd).st_size == 0:
+                    os.write(self.fd, self.MAGIC)
+                    created = True
+        if not created and self.file.read(len(self.MAGIC)) != self.MAGIC:
+            raise ValueError(f"Not a jacket pack: {path}")
+        self.scanned = len(self.MAGIC)
+        self._scan()
+        
+        # 新建的封面包自动导入旧版的散装封面文件
+        if created and import_dir and os.path.isdir(import_dir):
+            imported = self.import_directory(import_dir)
+            if imported:
+                print(f"Imported {imported} covers from {import_dir} into {path}")
+
+    def _scan(self):
+        """从上次扫描的位置继续读取记录头，更新索引（包括其他进程追加的记录）"""
+        end = os.fstat(self.fd).st_size
+        if end == self.scanned:
+            return  # 上次扫描后没有新的记录
+        self.scanned = self._scan_range(self.scanned, end)
+        if self.scanned < end:
+            # 末尾的数据无法解析：可能是其他进程正在追加，也可能是写入中断留下的。
+            # 追加在文件锁内进行，拿到锁后仍然无法解析的部分只能是后者，截断到最后一条完整记录之后
+            with FileLock(self.lock_path):
+                end = os.fstat(self.fd).st_size
+                self.scanned = self._scan_range(self.scanned, end)
+                if self.scanned < end:
+                    print(f"Warning: Truncating {end - self.scanned} bytes of incomplete data at the end of {self.path}")
+                    os.ftruncate(self.fd, self.scanned)
+
+    def _scan_range(self, position, end):
+        """扫描[position, end)中的记录并加入索引，跳过损坏的部分，返回最后一条完整记录的结束位置"""
+        while position < end:
+            record = self._read_record(position, end)
+            if record is None:
+                # 损坏的记录：寻找下一条完整且校验通过的记录，找不到时留给调用者处理
+                next_position = self._resync(position + 1, end)
+                if next_position is None:
+                    break
+                print(f"Warning: Skipped {next_position - position} corrupted bytes in {self.path} at offset {position}")
+                position = next_position
+                continue
+            key, data_offset, length, crc = record
+            self.index[key] = (data_offset, length, crc)
+            position = data_offset + length
+        return position
+
+    def _read_record(self, position, end, check_crc=False):
+        """解析position处的记录，返回(key, 数据偏移, 数据长度, crc32)；记录损坏或不完整时返回None"""
+        if position + self.RECORD.size > end:
+            return None
+        self.file.seek(position)
+        mark, key_length, length, crc = self.RECORD.unpack(self.file.read(self.RECORD.size))
+        data_offset = position + self.RECORD.size + key_length
+        if mark != self.RECORD_MARK or data_offset + length > end:
+            return None
+        try:
+            key = self.file.read(key_length).decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        if check_crc and zlib.crc32(self.file.read(length)) != crc:
+            return None
+        return key, data_offset, length, crc
+
+    def _resync(self, position, end):
+        """从position开始查找下一条完整且crc32校验通过的记录，返回其偏移，找不到时返回None"""
+        self.file.seek(position)
+        buffer = self.file.read(end - position)
+        found = buffer.find(self.RECORD_MARK)
+        while found >= 0:
+            if self._read_record(position + found, end, check_crc=True) is not None:
+                return position + found
+            found = buffer.find(self.RECORD_MARK, found + 1)
+        return None
+
+    def refresh(self):
+        """读取其他进程新追加的记录"""
+        with self.lock:
+            self._scan()
+
+    def _lookup(self, key):
+        """查找索引，不访问文件系统"""
+        return self.index.get(key)
+
+    def __contains__(self, key):
+        return self._lookup(str(key)) is not None
+
+    def keys(self):
+        return list(self.index)
+
+    def signature(self, key):
+        """记录的签名（偏移和crc32），记录被覆盖后签名随之变化；不存在时为'none'"""
+        entry = self._lookup(str(key))
+        if entry is None:
+            return 'none'
+        return f"{entry[0]:x}-{entry[2]:08x}"
+
+    def read(self, key):
+        """读取记录数据，不存在或校验失败时返回None"""
+        entry = self._lookup(str(key))
+        if entry is None:
+            return None
+        offset, length, crc = entry
+        with self.lock:
+            if self.map is None or len(self.map) < offset + length:
+                # 文件增长后重新映射
+                if self.map is not None:
+                    self.map.close()
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self.map[offset:offset + length]
+        if zlib.crc32(data) != crc:
+            print(f"Warning: Checksum mismatch for {key} in {self.path}, dropping it from the index")
+            with self.lock:
+                # 移除后视为缺失，下次预取时重新下载
+                if self.index.get(str(key)) == entry:
+                    del self.index[str(key)]
+            return None
+        return data
+
+    def append(self, key, data):
+        """追加一条记录，整条记录一次写入，不会留下被索引的半条记录"""
+        key_bytes = str(key).encode('utf-8')
+        record = self.RECORD.pack(self.RECORD_MARK, len(key_bytes), len(data), zlib.crc32(data)) + key_bytes + data
+        with self.lock:
+            with FileLock(self.lock_path):
+                written = os.write(self.fd, record)
+            if written != len(record):
+                raise OSError(f"Short write to {self.path}")
+            self._scan()
+
+    def import_directory(self, directory, extension='.webp'):
+        """导入散装的封面文件（文件名为key），已存在的key跳过，返回导入数量"""
+        imported = 0
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            key, ext = os.path.splitext(entry.name)
+            if not entry.is_file() or ext != extension or key in self.index:
+                continue
+            with open(entry.path, 'rb') as f:
+                self.append(key, f.read())
+            imported += 1
+        return imported
+
+    def verify(self):
+        """校验所有记录，返回校验失败的key列表"""
+        return [key for key in self.keys() if self.read(key) is None]
+
+    def stats(self):
+        """封面包的占用：{'records', 'bytes', 'live_bytes'}，被覆盖的旧记录不计入live_bytes"""
+        self.refresh()
+        with self.lock:
+            return {
+                'records': len(self.index),
+                'bytes': os.fstat(self.fd).st_size,
+                'live_bytes': sum(length for _, length, _ in self.index.values()),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+            os.close(self.fd)
+
+class JacketPrefetcher:
+    """
+    封面预取：所有请求共用一个keep-alive连接池，并发数根据观察到的延迟和错误率自适应调整
+    （成功且延迟正常时加1，出错或延迟过高时减半）。
+    同一music_id正在下载时合并为同一个Future，每个封面有独立的截止时间，下载结果追加到封面包。
+    失败后（404除外）按指数退避（带随机抖动）最多重试max_retries次
+    """
+    URL = "https://oss.bemanicn.com/SDDT/cover/{music_id}.webp-thumbnail"
+    HEADERS = {
+        "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Google Chrome\";v=\"134\"",
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": "\"Windows\"",
+        "Referer": "https://u.otogame.net/",
+    }
+
+    def __init__(self, jacket_store, max_workers=16, initial_concurrency=4, item_timeout=20, request_timeout=5, target_latency=1.0,
+                 max_retries=2, retry_backoff=0.5):
+        self.jacket_store = jacket_store
+        self.max_workers = max_workers
+        self.item_timeout = item_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff  # 第一次重试前等待的秒数，之后每次翻倍
+        self.request_timeout = request_timeout
+        self.target_latency = target_latency
+        
+        self.session = requests.Session()
+        self.session.headers.update(self.HEADERS)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        
+        self.condition = Condition()
+        self.concurrency = initial_concurrency  # 当前允许同时进行的请求数
+        self.active = 0
+        self.latency = None  # 请求延迟的指数滑动平均
+        self.in_flight = {}  # music_id -> Future
+        self.stats = {'downloaded': 0, 'not_found': 0, 'failed': 0}
+
+    def fetch(self, music_id, deadline=None):
+        """
+        预取单个封面，返回Future，结果为封面是否已在封面包中。
+        每个封面从第一次拿到并发名额时开始计时，最多item_timeout秒，排队等待的时间不计入；
+        deadline为整批的截止时间(time.monotonic()时间)，为None时不限制
+        """
+        with self.condition:
+            future = self.in_flight.get(music_id)
+            if future is not None:
+                return future
+            if music_id in self.jacket_store:
+                future = Future()
+                future.set_result(True)
+                return future
+            future = self.executor.submit(self._fetch, music_id, deadline)
+            self.in_flight[music_id] = future
+        future.add_done_callback(lambda _: self._forget(music_id))
+        return future
+
+    def prefetch(self, music_ids, deadline=None):
+        """按顺序预取多个封面，返回{music_id: Future}"""
+        return {music_id: self.fetch(music_id, deadline) for music_id in dict.fromkeys(music_ids)}
+
+    def _forget(self, music_id):
+        with self.condition:
+            self.in_flight.pop(music_id, None)
+
+    def _acquire(self, deadline):
+        """等待空闲的并发名额，超过截止时间时返回False；deadline为None时一直等待"""
+        with self.condition:
+            while self.active >= self.concurrency:
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.active += 1
+            return True
+
+    def _release(self, latency, ok):
+        """归还并发名额，并根据本次请求的结果调整并发数"""
+        with self.condition:
+            self.active -= 1
+            self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+            if ok and self.latency <= self.target_latency:
+                self.concurrency = min(self.concurrency + 1, self.max_workers)
+            elif not ok or self.latency > self.target_latency * 2:
+                self.concurrency = max(1, self.concurrency // 2)
+            self.condition.notify_all()
+
+    def _fetch(self, music_id, deadline):
+        last_error = "deadline exceeded"
+        item_deadline = None  # 第一次拿到并发名额时开始计时
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # 指数退避，乘以0.5~1.5的随机系数，避免多个封面同时重试
+                delay = self.retry_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if time.monotonic() + delay >= item_deadline:
+                    break
+                time.sleep(delay)
+            if not self._acquire(deadline if item_deadline is None else item_deadline):
+                break
+            start_time = time.monotonic()
+            if item_deadline is None:
+                item_deadline = start_time + self.item_timeout
+                if deadline is not None:
+                    item_deadline = min(item_deadline, deadline)
+            ok = False
+            try:
+                timeout = max(0.1, min(self.request_timeout, item_deadline - start_time))
+                response = self.session.get(self.URL.format(music_id=music_id), timeout=timeout)
+                if response.status_code == 404:
+                    ok = True
+                    print(f"404 error downloading cover {music_id}, no retry")
+                    with self.condition:
+                        self.stats['not_found'] += 1
+                    return False
+                response.raise_for_status()
+                Image.open(io.BytesIO(response.content))  # 确认是有效的图片
+                # 原始数据追加到封面包，不重新编码
+                self.jacket_store.append(music_id, response.content)
+                ok = True
+                with self.condition:
+                    self.stats['downloaded'] += 1
+                return True
+            except Exception as e:
+                # 连接错误（包括连接超时、keep-alive连接被重置）、超时和5xx都按退避重试
+                last_error = e
+            finally:
+                self._release(time.monotonic() - start_time, ok)
+        
+        print(f"Failed to download cover {music_id}: {last_error}, using fallback")
+        with self.condition:
+            self.stats['failed'] += 1
+        return False
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+class BackgroundAtlas:
+    """
+    进程池共享的单元格背景图集：父进程把用到的背景（已模糊、已叠加遮罩）按RGBX原始字节追加到一个临时文件中，
+    子进程mmap映射该文件后直接从中读取，不再各自解码和模糊封面。
+    使用RGBX而不是RGB，是因为Pillow只能直接映射每像素4字节的缓冲区，RGB数据在frombuffer时会被复制。
+    所有进程映射同一个文件，共享操作系统的页缓存，内存只随不同谱面的数量增长，与进程数无关
+    """
+    def __init__(self, cell_size, max_bytes=256 * 1024 * 1024, directory=None):
+        self.cell_size = tuple(cell_size)
+        self.tile_bytes = self.cell_size[0] * self.cell_size[1] * 4
+        self.max_bytes = max_bytes
+        self.index = {}  # key -> 偏移量
+        self.size = 0
+        self.lock = Lock()
+        fd, self.path = tempfile.mkstemp(prefix='backgrounds-', suffix='.atlas', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+
+    @property
+    def full(self):
+        return self.size >= self.max_bytes
+
+    def ensure(self, key, builder):
+        """返回背景在图集中的引用(路径, 偏移量, 尺寸)，不在图集中时调用builder()生成并追加"""
+        with self.lock:
+            offset = self.index.get(key)
+            if offset is None:
+                background = builder()
+                if background.size != self.cell_size or background.mode != 'RGB':
+                    raise ValueError(f"Background {key} does not match atlas cell size {self.cell_size}")
+                offset = self.size
+                self._file.seek(offset)
+                self._file.write(background.convert('RGBX').tobytes())
+                # 写入操作系统的页缓存后子进程即可映射读取
+                self._file.flush()
+                self.index[key] = offset
+                self.size += self.tile_bytes
+        return self.path, offset, self.cell_size
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                # 子进程中已有的映射在文件删除后仍然有效
+                os.remove(self.path)
+
+_default_jacket_pack = None
+
+def get_default_jacket_pack():
+    """进程级共享的封面包"""
+    global _default_jacket_pack
+    if _default_jacket_pack is None:
+        _default_jacket_pack = JacketPack()
+    return _default_jacket_pack
+
+_default_jacket_cache = None
+
+def get_default_jacket_cache():
+    """进程级共享的已解码封面缓存"""
+    global _default_jacket_cache
+    if _default_jacket_cache is None:
+        _default_jacket_cache = JacketImageCache()
+    return _default_jacket_cache
+
+_default_tile_cache = None
+
+def get_default_tile_cache():
+    """进程级共享的单元格背景缓存"""
+    global _default_tile_cache
+    if _default_tile_cache is None:
+        _default_tile_cache = JacketTileCache()
+    return _default_tile_cache
+
+_default_cell_cache = None
+
+def get_default_cell_cache():
+    """进程级共享的单元格图块缓存，多个区段和多个玩家之间复用"""
+    global _default_cell_cache
+    if _default_cell_cache is None:
+        _default_cell_cache = CellTileCache()
+    return _default_cell_cache
+
+_default_render_cache = None
+
+def get_default_render_cache():
+    """进程级共享的渲染结果缓存"""
+    global _default_render_cache
+    if _default_render_cache is None:
+        _default_render_cache = RenderCache()
+    return _default_render_cache
+
+def get_disk_caches():
+    """进程级共享的各个磁盘缓存目录：名称 -> DiskImageStore"""
+    caches = {
+        'tiles': get_default_tile_cache().disk,
+        'renders': get_default_render_cache().store,
+    }
+    if get_default_cell_cache().disk is not None:
+        caches['cells'] = get_default_cell_cache().disk
+    return caches
+
+def parse_size(text):
+    """解析容量，如512K、64M、1G，不带单位时为字节数"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_size(size):
+    return f"{size / 1024 / 1024:.1f} MB"
+
+def cache_main(argv=None):
+    """磁盘缓存管理：stats显示各缓存目录的占用，prune删除残留的临时文件并按最近使用时间淘汰"""
+    import argparse
+    caches = get_disk_caches()
+    parser = argparse.ArgumentParser(prog='b55_gram.py cache', description='查看和清理磁盘缓存')
+    parser.add_argument('command', choices=['stats', 'prune'])
+    parser.add_argument('--max-bytes', type=parse_size, help='prune时每个缓存目录保留的容量，如64M、1G，0为清空；默认为各缓存的容量上限')
+    parser.add_argument('--cache', choices=sorted(caches), action='append', help='只处理指定的缓存，可重复指定')
+    args = parser.parse_args(argv)
+    
+    for name in args.cache or caches:
+        store = caches[name]
+        if args.command == 'stats':
+            stats = store.stats()
+            age = f", oldest used {(time.time() - stats['oldest']) / 3600:.1f}h ago" if stats['oldest'] else ""
+            print(f"{name}: {store.cache_dir}, {stats['files']} files, "
+                  f"{format_size(stats['bytes'])} / {format_size(stats['max_bytes'])}{age}")
+        else:
+            result = store.prune(args.max_bytes)
+            print(f"{name}: removed {result['removed']} files ({format_size(result['freed'])}), "
+                  f"{result['files']} files ({format_size(result['bytes'])}) left")
+    
+    # 封面包是下载的源数据，只追加，不参与淘汰
+    if args.command == 'stats' and not args.cache and os.path.exists(JACKET_PACK_PATH):
+        stats = get_default_jacket_pack().stats()
+        print(f"jackets: {JACKET_PACK_PATH}, {stats['records']} covers, "
+              f"{format_size(stats['bytes'])} ({format_size(stats['live_bytes'])} live)")
+
+# 输出格式 -> (PIL格式名, 默认参数)
+OUTPUT_FORMATS = {
+    'png': ('PNG', {'compress_level': 6}),
+    'webp': ('WEBP', {'quality': 90, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 90}),
+}
+OUTPUT_EXTENSIONS = {'.png': 'png', '.webp': 'webp', '.jpg': 'jpeg', '.jpeg': 'jpeg'}
+
+def resolve_output_format(output=None, fmt=None):
+    """输出格式：fmt为None时按文件扩展名判断，默认为png"""
+    if fmt is None:
+        extension = os.path.splitext(output)[1].lower() if isinstance(output, str) else ''
+        fmt = OUTPUT_EXTENSIONS.get(extension, 'png')
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    return fmt
+
+def encode_image(image, output=None, fmt=None, quality=None, compress_level=None, lossless=False, quantize=None):
+    """
+    编码输出图片。
+    output: 文件路径、可写的流，或None（返回编码后的字节）
+    fmt: png/webp/jpeg，为None时按文件扩展名判断，默认为png
+    quality: WebP/JPEG质量；compress_level: PNG压缩级别(0-9)；lossless: WebP无损
+    quantize: 调色板颜色数，为None时不量化（JPEG不支持）
+    返回: {'format', 'data', 'size', 'encode_time'}，data仅在output为None时有值
+    """
+    fmt = resolve_output_format(output, fmt)
+    pil_format, options = OUTPUT_FORMATS[fmt]
+    options = dict(options)
+    if quality is not None and fmt != 'png':
+        options['quality'] = quality
+    if compress_level is not None and fmt == 'png':
+        options['compress_level'] = compress_level
+    if lossless and fmt == 'webp':
+        options['lossless'] = True
+    
+    start_time = time.perf_counter()
+    if quantize:
+        if fmt == 'jpeg':
+            raise ValueError("JPEG output does not support palette quantization")
+        image = image.quantize(colors=quantize, method=Image.Quantize.FASTOCTREE)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **options)
+    data = buffer.getvalue()
+    
+    if isinstance(output, str):
+        write_file_atomic(output, data)
+    elif output is not None:
+        output.write(data)
+    
+    return {
+        'format': fmt,
+        'data': data if output is None else None,
+        'size': len(data),
+        'encode_time': time.perf_counter() - start_time,
+    }
+
+class StreamingPNGWriter:
+    """
+    逐条写入RGB PNG：每个条带按行选择滤波方式（None/Sub/Up中绝对值和最小的一种）后送入zlib压缩，
+    压缩结果立即作为IDAT块写出，内存中只保留当前条带，与图像总高度无关。
+    先写临时文件，close()后重命名为目标文件
+    """
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    IDAT_SIZE = 256 * 1024
+    FILTER_ROWS = 64  # 每次滤波的行数，限制临时数组的大小
+
+    def __init__(self, output, width, height, compress_level=6):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.size = 0
+        self._previous_row = np.zeros(width * 3, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+        self._tmp_path = atomic_temp_path(output)
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(self.SIGNATURE)
+        self.size += len(self.SIGNATURE)
+        # IHDR: 8位RGB，不隔行
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+        self.size += len(data) + 12
+
+    def _emit(self, data, flush=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending and (flush or self._pending_size >= self.IDAT_SIZE):
+            self._write_chunk(b'IDAT', b''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write(self, strip):
+        """写入下一条带（宽度与图像相同的RGB图像）"""
+        if strip.size[0] != self.width or self.rows_written + strip.size[1] > self.height:
+            raise ValueError("Strip does not fit the remaining image area")
+        pixels = np.asarray(strip.convert('RGB'), dtype=np.uint8).reshape(strip.size[1], self.width * 3)
+        for start in range(0, pixels.shape[0], self.FILTER_ROWS):
+            rows = pixels[start:start + self.FILTER_ROWS]
+            above = np.vstack([self._previous_row[None, :], rows[:-1]])
+            left = np.zeros_like(rows)
+            left[:, 3:] = rows[:, :-3]
+            candidates = np.stack([rows, rows - left, rows - above])  # 0=None, 1=Sub, 2=Up
+            # 与libpng相同的启发式：按有符号字节的绝对值之和选择，uint8下|v| = min(v, -v)
+            costs = np.minimum(candidates, 0 - candidates).sum(axis=2, dtype=np.uint32)
+            filters = costs.argmin(axis=0)
+            filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 0] = filters
+            filtered[:, 1:] = candidates[filters, np.arange(rows.shape[0])]
+            self._emit(self._compressor.compress(filtered.tobytes()))
+            self._previous_row = rows[-1].copy()
+        self.rows_written += strip.size[1]
+
+    def close(self):
+        """写出剩余数据和IEND块，并重命名为目标文件"""
+        if self._file is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG expects {self.height} rows, got {self.rows_written}")
+            self._emit(self._compressor.flush(), flush=True)
+            self._write_chunk(b'IEND', b'')
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.output)
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._tmp_path)
 
 def calculate_constant(score, rating):
         rating = rating / 100  # 将rating转换为小数形式
@@ -47,68 +1565,173 @@ def calculate_constant(score, rating):
         return round(constant * 10) / 10
 
 class B55GramGenerator:
-    def __init__(self):
-        self.cell_width = 400  # 原200*2
-        self.cell_height = 200  # 原100*2
-        self.grid_width = 5  # 每行5首歌
-        self.section_padding = 60  # 原30*2
-        self.font_size = 28  # 原14*2
-        self.title_font_size = 60  # 原30*2
-        self.profile_height = 280  # 原130*2
-        
-        # 创建缓存目录
-        if not os.path.exists('cache'):
-            os.makedirs('cache')
-            
-        # 创建assets目录和assets/cover子目录
-        if not os.path.exists('assets'):
-            os.makedirs('assets')
-        if not os.path.exists('assets/cover'):
-            os.makedirs('assets/cover')
-            
-        # 下载难度指示器图片
-        self.difficulty_images = self.download_difficulty_images()
-        
-        # 加载等级图标
-        self.rank_images = self.load_rank_images()
-            
-        # 初始化线程池和缓存
-        self.executor = ThreadPoolExecutor(max_workers=10)  # 最多10个并发下载线程
-        self.image_cache = {}
+    def __init__(self, tile_cache=None, cell_cache=None, jacket_store=None, jacket_cache=None, assets=None, render_workers=1, render_pool='thread', incremental=False, verify_incremental=False, scale=1.0, offline=False, layout='b55', render_cache=None):
+        # 构造时不访问磁盘和网络：资源、字体和封面包都在首次使用时才加载，
+        # 网络下载需要显式调用fetch_assets()，offline为True时也不下载封面
+        # 渲染缩放比例：所有尺寸、位置和字号都按比例计算，1.0为完整分辨率，0.5为预览
+        self.scale = scale
+        self.cell_width = self.px(400)  # 原200*2
+        self.cell_height = self.px(200)  # 原100*2
+        self.background_color = (32, 32, 32)
+        self.jacket_blur_radius = self.px(4)
+        self.diff_icon_size = self.px((232, 30))  # 原(116, 15)*2
+        self.rank_icon_size = self.px((100, 50))  # 原(50, 25)*2
+        # 布局可以是LAYOUTS中的名称或同样结构的字典
+        self.layout = LAYOUTS[layout] if isinstance(layout, str) else layout
+        self.layout_key = layout if isinstance(layout, str) else json.dumps(layout, sort_keys=True)
+        self.grid_width = self.layout['columns']  # 每行的歌曲数
+        self.section_padding = self.px(self.layout['section_padding'])
+        self.font_size = self.px(28)  # 原14*2
+        self.title_font_size = self.px(60)  # 原30*2
+        self.profile_height = self.px(280)  # 原130*2
+        self.rating_badge_pos = self.px((420, 155))  # 原(170, 83)*2
+        self.rating_badge_size = self.px((430, 130))  # 原(200, 40)*2
+        
+        self.assets = assets if assets is not None else get_default_asset_bundle()
+        self.offline = offline
+        self._lazy = {}
+        
+        # 初始化缓存
         self.cache_lock = Lock()
-        self.download_queue = queue.Queue()
-        
-        # 下载并缓存默认封面
-        self.fallback_jacket = self.download_fallback_jacket()
-        
-        # 尝试加载中日文字体
+        self._prefetcher = None
+        self._pending_jackets = {}  # 正在预取的封面，渲染对应单元格前等待
+        self._jacket_store = jacket_store
+        self.jacket_cache = jacket_cache if jacket_cache is not None else get_default_jacket_cache()
+        self.tile_cache = tile_cache if tile_cache is not None else get_default_tile_cache()
+        self.cell_cache = cell_cache if cell_cache is not None else get_default_cell_cache()
+        self.render_cache = render_cache if render_cache is not None else get_default_render_cache()
+        
+        # 单元格渲染线程池/进程池，render_workers<=1时串行渲染
+        self.render_workers = render_workers
+        self.render_pool = render_pool
+        self._render_executor = None
+        self._background_atlas = None  # 进程池渲染时与子进程共享的单元格背景
+        self._scaled_generators = {}
+        
+        # 增量渲染：保留上一次的结果和每个单元格的指纹，只重绘变化的部分
+        # verify_incremental为测试模式，每次增量渲染后与完整渲染结果比较
+        self.incremental = incremental
+        self.verify_incremental = verify_incremental
+        self._previous_render = None
+        
+    def _get_lazy(self, name, loader):
+        """首次使用时加载并缓存"""
+        with self.cache_lock:
+            if name not in self._lazy:
+                self._lazy[name] = loader()
+            return self._lazy[name]
+
+    @property
+    def jacket_store(self):
+        if self._jacket_store is None:
+            self._jacket_store = get_default_jacket_pack()
+        return self._jacket_store
+
+    @property
+    def difficulty_images(self):
+        return self.assets.difficulty_images
+
+    @property
+    def rank_images(self):
+        return self.assets.rank_images
+
+    @property
+    def rank_thresholds(self):
+        return self.assets.rank_thresholds
+
+    @property
+    def icon_atlas(self):
+        """预缩放图标，所有生成器共享"""
+        return IconAtlas.get(self.rank_images, self.difficulty_images, self.rank_icon_size, self.diff_icon_size,
+                             self.assets.signature)
+
+    @property
+    def cell_overlay(self):
+        """单元格半透明遮罩，直接合成到缓存的背景中"""
+        return self._get_lazy('cell_overlay', lambda: Image.new('RGBA', (self.cell_width, self.cell_height), (0, 0, 0, 128)))
+
+    @property
+    def fallback_jacket(self):
+        return self._get_lazy('fallback_jacket', self.load_fallback_jacket)
+
+    @property
+    def font(self):
+        return self._get_lazy('fonts', self.load_fonts)['font']
+
+    @property
+    def title_font(self):
+        return self._get_lazy('fonts', self.load_fonts)['title_font']
+
+    @property
+    def profile_font(self):
+        return self._get_lazy('fonts', self.load_fonts)['profile_font']
+
+    @property
+    def rating_font(self):
+        return self._get_lazy('fonts', self.load_fonts)['rating_font']
+
+    def load_fonts(self):
+        """加载中日文字体，失败时使用默认字体"""
         try:
-            # Windows 系统默认中日文字体
+            # Windows 系统使用自带的中日文字体
             if os.name == 'nt':
-                self.font = ImageFont.truetype("assets/fonts/combined.ttf", self.font_size)  # NP-R
-                self.title_font = ImageFont.truetype("assets/fonts/combined.ttf", self.title_font_size)
-                self.profile_font = ImageFont.truetype("assets/fonts/BIZ-UDGOTHICB.TTC", 40)  # 原20*2
-                self.rating_font = ImageFont.truetype("assets/fonts/BIZ-UDGOTHICB.TTC", 72)  # 原36*2
+                cjk_font = "combined.ttf"  # NP-R
+                profile_font = "BIZ-UDGOTHICB.TTC"
             # macOS 系统默认中日文字体
-            elif os.name == 'posix':
-                self.font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", self.font_size)
-                self.title_font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", self.title_font_size)
-                self.profile_font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", 40)
-                self.rating_font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", 72)
+            elif sys.platform == 'darwin':
+                cjk_font = profile_font = "PingFang.ttc"
             # Linux 系统默认中日文字体
             else:
-                self.font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", self.font_size)
-                self.title_font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", self.title_font_size)
-                self.profile_font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 40)
-                self.rating_font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 72)
+                cjk_font = profile_font = "NotoSansCJK-Regular.ttc"
+            return {
+                'font': FontRegistry.get(cjk_font, self.font_size),
+                'title_font': FontRegistry.get(cjk_font, self.title_font_size),
+                'profile_font': FontRegistry.get(profile_font, self.px(40)),  # 原20*2
+                'rating_font': FontRegistry.get(profile_font, self.px(72)),  # 原36*2
+            }
         except Exception as e:
             print(f"Warning: Failed to load CJK font: {e}")
             print("Falling back to default font...")
-            self.font = ImageFont.load_default()
-            self.title_font = ImageFont.load_default()
-            self.profile_font = ImageFont.load_default()
-            self.rating_font = ImageFont.load_default()
-        
+            default_font = ImageFont.load_default()
+            return {'font': default_font, 'title_font': default_font, 'profile_font': default_font, 'rating_font': default_font}
+
+    def fetch_assets(self, timeout=10):
+        """显式下载缺失的资源（难度图标、默认封面），离线环境中不要调用"""
+        fetched = self.assets.fetch(self.jacket_store, timeout)
+        with self.cache_lock:
+            self._lazy.pop('fallback_jacket', None)
+        return fetched
+
+    def px(self, value):
+        """将完整分辨率下的尺寸按渲染比例换算为像素，支持单个数值或元组"""
+        if isinstance(value, tuple):
+            return tuple(self.px(v) for v in value)
+        return max(1, int(round(value * self.scale))) if value else 0
+
+    def scaled(self, scale):
+        """获取另一缩放比例的生成器，与当前生成器共享封面和图块缓存"""
+        if scale == self.scale:
+            return self
+        generator = self._scaled_generators.get(scale)
+        if generator is None:
+            generator = self.clone(scale=scale)
+            self._scaled_generators[scale] = generator
+        return generator
+
+    def clone(self, scale=None, render_workers=None, incremental=None, layout=None):
+        """
+        创建共享所有缓存（字体、图标、封面、图块）的生成器。
+        每个生成器各自持有渲染中的图像，不同的生成器可以在不同线程中同时渲染
+        """
+        return B55GramGenerator(tile_cache=self.tile_cache, cell_cache=self.cell_cache,
+                                jacket_store=self._jacket_store, jacket_cache=self.jacket_cache, assets=self.assets,
+                                render_workers=self.render_workers if render_workers is None else render_workers,
+                                render_pool=self.render_pool,
+                                incremental=self.incremental if incremental is None else incremental,
+                                verify_incremental=self.verify_incremental,
+                                scale=self.scale if scale is None else scale, offline=self.offline,
+                                layout=self.layout if layout is None else layout, render_cache=self.render_cache)
+
     def calculate_constant(score, rating):
         rating = rating / 100  # 将rating转换为小数形式
         
@@ -145,208 +1768,81 @@ class B55GramGenerator:
         # 将定数四舍五入到最近的0.1
         return round(constant * 10) / 10
 
-    def download_difficulty_images(self):
-        """下载所有难度指示器图片"""
-        difficulty_types = ["basic", "advanced", "expert", "master", "lunatic"]
-        difficulty_images = {}
-        
-        for diff_type in difficulty_types:
-            image_path = f'assets/diff_{diff_type}.png'
-            
-            # 如果已经存在，直接加载
-            if os.path.exists(image_path):
-                difficulty_images[diff_type] = Image.open(image_path)
-                continue
-                
-            # 下载图片
-            url = f"https://u.otogame.net/img/ongeki/diff_{diff_type}.png"
+    def load_fallback_jacket(self):
+        """加载默认封面（保存在封面包中），不访问网络；缺失时使用纯黑色图片"""
+        data = self.jacket_store.read('fallback')
+        if data is None:
+            # 导入旧版本保存的散装文件
+            for legacy_path in ('assets/cover/fallback.webp', 'cache/fallback.webp'):
+                if os.path.exists(legacy_path):
+                    with open(legacy_path, 'rb') as f:
+                        data = f.read()
+                    self.jacket_store.append('fallback', data)
+                    break
+        if data is not None:
             try:
-                response = requests.get(url)
-                response.raise_for_status()
-                img = Image.open(io.BytesIO(response.content))
-                # 保存到assets目录
-                img.save(image_path)
-                difficulty_images[diff_type] = img
-                print(f"Downloaded and saved {diff_type} difficulty image")
-            except Exception as e:
-                print(f"Error downloading {diff_type} difficulty image: {e}")
-                # 创建一个空白图片作为备用
-                difficulty_images[diff_type] = Image.new('RGBA', (116, 15), (0, 0, 0, 0))
-                
-        return difficulty_images
-
-    def download_fallback_jacket(self):
-        """下载默认封面图片"""
-        cache_path = 'cache/fallback.webp'
-        assets_path = 'assets/cover/fallback.webp'
-        
-        # 首先检查assets目录
-        if os.path.exists(assets_path):
-            return Image.open(assets_path)
-            
-        # 然后检查缓存目录
-        if os.path.exists(cache_path):
-            img = Image.open(cache_path)
-            # 保存到assets目录
-            img.save(assets_path)
-            return img
-            
-        url = "https://u.otogame.net/img/ongeki/musicjacket_fallback.webp"
-        headers = {
-            "Referer": "https://u.otogame.net/",
-        }
-        
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            img = Image.open(io.BytesIO(response.content))
-            # 保存到两个位置
-            img.save(cache_path)
-            img.save(assets_path)
-            return img
-        except Exception as e:
-            print(f"Error downloading fallback jacket: {e}")
-            # 创建一个纯黑色的图片作为最后的备选
-            return Image.new('RGB', (self.cell_width, self.cell_height), (0, 0, 0))
-        
-    def _download_single_jacket(self, music_id, max_retries=2, timeout=5):
-        """下载单个封面的内部方法"""
-        cache_path = f'cache/{music_id}.webp'
-        assets_path = f'assets/cover/{music_id}.webp'
-        
-        # 如果已经在缓存中，直接返回
-        with self.cache_lock:
-            if music_id in self.image_cache:
-                return self.image_cache[music_id]
-        
-        # 如果文件已存在，加载并缓存
-        if os.path.exists(assets_path):
-            try:
-                img = Image.open(assets_path)
-                with self.cache_lock:
-                    self.image_cache[music_id] = img
-                return img
-            except Exception as e:
-                print(f"Warning: Failed to load existing cover {music_id}: {e}")
-                # 如果加载失败，继续尝试下载
-            
-        url = f"https://oss.bemanicn.com/SDDT/cover/{music_id}.webp-thumbnail"
-        headers = {
-            "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Google Chrome\";v=\"134\"",
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": "\"Windows\"",
-            "Referer": "https://u.otogame.net/",
-        }
-        
-        for retry in range(max_retries):
-            try:
-                response = requests.get(url, headers=headers, timeout=timeout)
-                response.raise_for_status()
-                img = Image.open(io.BytesIO(response.content))
-                
-                # 保存到缓存和assets目录
-                try:
-                    img.save(cache_path)
-                    img.save(assets_path)
-                except Exception as e:
-                    print(f"Warning: Failed to save cover {music_id}: {e}")
-                
-                # 添加到内存缓存
-                with self.cache_lock:
-                    self.image_cache[music_id] = img
+                with Image.open(io.BytesIO(data)) as img:
+                    img.load()
                 return img
-                
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 404:
-                    print(f"404 error downloading cover {music_id}, no retry")
-                    return self.fallback_jacket
-                else:
-                    if retry < max_retries - 1:
-                        print(f"HTTP error downloading cover {music_id}: {e}, retrying...")
-                        continue
-                    print(f"HTTP error downloading cover {music_id}: {e}, using fallback")
-                    return self.fallback_jacket
-                
-            except requests.Timeout:
-                if retry < max_retries - 1:
-                    print(f"Timeout downloading cover {music_id}, retrying...")
-                    continue
-                print(f"Timeout downloading cover {music_id}, using fallback")
-                return self.fallback_jacket
-                
             except Exception as e:
-                if retry < max_retries - 1:
-                    print(f"Error downloading cover {music_id}: {e}, retrying...")
-                    continue
-                print(f"Failed to download cover {music_id}: {e}, using fallback")
-                return self.fallback_jacket
+                print(f"Error loading fallback jacket: {e}")
         
-        return self.fallback_jacket
+        print("Warning: Fallback jacket not found; run fetch_assets() to download it")
+        # 创建一个纯黑色的图片作为最后的备选
+        return Image.new('RGB', (self.cell_width, self.cell_height), (0, 0, 0))
+
+    def get_prefetcher(self):
+        """延迟创建封面预取器"""
+        if self._prefetcher is None:
+            self._prefetcher = JacketPrefetcher(self.jacket_store)
+        return self._prefetcher
 
-    def preload_jackets(self, music_list):
-        """预加载所有歌曲封面"""
+    def preload_jackets(self, music_list, wait=True):
+        """
+        预加载所有歌曲封面，返回{music_id: Future}。
+        wait为False时立即返回，渲染单元格前再等待对应的封面（见wait_for_jacket）
+        """
         print("开始预加载封面...")
-        start_time = time.time()
-        
-        # 收集所有需要下载的music_id
-        music_ids = []
-        for song in music_list:
-            music_id = song['music']['music_id']
-            # 如果封面已经在缓存或assets目录中，跳过
-            if music_id in self.image_cache or os.path.exists(f'assets/cover/{music_id}.webp'):
-                continue
-            music_ids.append(music_id)
+        # 读取其他进程追加的封面，本批次之后的查找不再访问文件系统
+        self.jacket_store.refresh()
         
+        # 收集所有需要下载的music_id，已在封面包中的跳过
+        music_ids = [song['music']['music_id'] for song in music_list]
+        music_ids = [music_id for music_id in dict.fromkeys(music_ids) if music_id not in self.jacket_store]
         if not music_ids:
             print("所有封面已缓存")
-            return
-            
-        total = len(music_ids)
-        completed = 0
-        failed = 0
-        
-        def download_with_progress(music_id):
-            nonlocal completed, failed
-            try:
-                self._download_single_jacket(music_id)
-                with self.cache_lock:
-                    completed += 1
-                    if completed % 5 == 0 or completed + failed == total:
-                        success_rate = (completed / (completed + failed)) * 100 if completed + failed > 0 else 0
-                        print(f"下载进度: {completed + failed}/{total} (成功率: {success_rate:.1f}%)")
-            except Exception as e:
-                with self.cache_lock:
-                    failed += 1
-                print(f"下载失败 {music_id}: {e}")
-        
-        # 使用线程池并发下载
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            for music_id in music_ids:
-                future = executor.submit(download_with_progress, music_id)
-                futures.append(future)
-            
-            # 等待所有下载完成，但设置总超时时间
-            try:
-                done, not_done = wait(futures, timeout=60)  # 设置60秒总超时
-                if not_done:
-                    print(f"警告: {len(not_done)}个封面下载超时")
-                    for future in not_done:
-                        future.cancel()
-            except Exception as e:
-                print(f"预加载过程出错: {e}")
+            return {}
+        if self.offline:
+            print(f"离线模式: {len(music_ids)}个封面缺失，使用默认封面")
+            return {}
         
+        start_time = time.time()
+        futures = self.get_prefetcher().prefetch(music_ids)
+        if wait:
+            self.report_prefetch(futures, start_time)
+        return futures
+
+    def report_prefetch(self, futures, start_time):
+        """等待预取完成（每个封面有各自的截止时间）并输出统计"""
+        completed = sum(1 for future in futures.values() if future.result())
+        total = len(futures)
         end_time = time.time()
         print(f"封面预加载完成，耗时: {end_time - start_time:.2f}秒")
-        print(f"成功: {completed}, 失败: {failed}, 总计: {total}")
+        print(f"成功: {completed}, 失败: {total - completed}, 总计: {total}")
+
+    def wait_for_jacket(self, music_id):
+        """等待正在预取的封面到达（或超过其截止时间）"""
+        future = self._pending_jackets.get(music_id)
+        if future is not None:
+            future.result()
 
     def download_jacket(self, music_id):
         """下载歌曲封面的公共方法"""
         try:
-            return self._download_single_jacket(music_id)
+            self.get_prefetcher().fetch(music_id).result()
         except Exception as e:
             print(f"Error downloading jacket {music_id}: {e}")
-            return self.fallback_jacket
+        return self.get_jacket(music_id)
 
     def get_difficulty_color(self, difficulty):
         """获取难度对应的颜色"""
@@ -359,142 +1855,128 @@ class B55GramGenerator:
         }
         return colors.get(difficulty, "#888888")
         
+    difficulty_names = {
+        0: "basic",
+        1: "advanced",
+        2: "expert",
+        3: "master",
+        10: "lunatic"
+    }
+
     def get_difficulty_image(self, difficulty):
         """获取难度对应的图片"""
-        difficulty_map = {
-            0: "basic",
-            1: "advanced",
-            2: "expert",
-            3: "master",
-            10: "lunatic"
-        }
-        diff_name = difficulty_map.get(difficulty, "master")
+        diff_name = self.difficulty_names.get(difficulty, "master")
         return self.difficulty_images.get(diff_name)
 
-    def load_rank_images(self):
-        """加载等级图标"""
-        rank_images = {}
-        rank_path = 'assets/ranks'
-        
-        # 等级对应关系
-        rank_map = {
-            1007500: 'sssplus',
-            1000000: 'sss',
-            990000: 'ss',
-            970000: 's',
-            940000: 'aaa',
-            900000: 'aa',
-            850000: 'a',
-            800000: 'bbb',
-            750000: 'bb',
-            700000: 'b',
-            500000: 'c',
-            0: 'd'
-        }
-        
-        # 加载所有等级图标
-        for score, rank in rank_map.items():
-            image_path = os.path.join(rank_path, f'score_tr_{rank}.png')
-            try:
-                if os.path.exists(image_path):
-                    img = Image.open(image_path)
-                    rank_images[score] = img
-                else:
-                    print(f"Warning: Rank image not found: {image_path}")
-            except Exception as e:
-                print(f"Error loading rank image {rank}: {e}")
-        
-        return rank_images
-        
     def get_rank_image(self, score):
         """获取对应分数的等级图标"""
-        thresholds = sorted(self.rank_images.keys(), reverse=True)
-        for threshold in thresholds:
+        for threshold in self.rank_thresholds:
             if score >= threshold:
                 return self.rank_images[threshold]
         return self.rank_images[0]  # 返回D等级图标作为默认值
 
-    def draw_song_cell(self, draw, x, y, song_data):
-        """绘制单个歌曲格子"""
-        # 获取封面（不会重复下载，因为已经在preload阶段完成）
-        music_id = song_data['music']['music_id']
-        jacket = None
+    def get_jacket(self, music_id):
+        """获取完整解码的歌曲封面（不会重复下载，因为已经在preload阶段完成）"""
+        data = self.jacket_store.read(music_id)
+        if data is not None:
+            try:
+                with Image.open(io.BytesIO(data)) as jacket:
+                    jacket.load()
+                return jacket
+            except Exception as e:
+                print(f"Error loading cover from pack for {music_id}: {e}")
+        else:
+            print(f"Warning: Cover for {music_id} not found in jacket pack, using fallback")
         
-        # 首先检查内存缓存
-        with self.cache_lock:
-            jacket = self.image_cache.get(music_id)
-            
-        # 如果内存缓存中没有，检查文件系统
-        if not jacket:
-            assets_path = f'assets/cover/{music_id}.webp'
-            if os.path.exists(assets_path):
-                try:
-                    jacket = Image.open(assets_path)
-                    # 加入内存缓存
-                    with self.cache_lock:
-                        self.image_cache[music_id] = jacket
-                except Exception as e:
-                    print(f"Error loading cover from file for {music_id}: {e}")
-                    jacket = self.fallback_jacket
-            else:
-                print(f"Warning: Cover for {music_id} not found in cache or filesystem, using fallback")
-                jacket = self.fallback_jacket
-                
-        if jacket:
-            # 使用fill而不是stretch来调整图片大小
-            # 首先创建一个空白画布
-            jacket_canvas = Image.new('RGB', (self.cell_width, self.cell_height))
-            
-            # 计算缩放比例，确保覆盖整个单元格
-            aspect_ratio = jacket.width / jacket.height
-            target_ratio = self.cell_width / self.cell_height
-            
-            if aspect_ratio > target_ratio:
-                # 图片比单元格更宽，基于高度调整
-                new_height = self.cell_height
-                new_width = int(new_height * aspect_ratio)
-                resized_jacket = jacket.resize((new_width, new_height))
-                
-                # 计算居中位置
-                left_offset = (new_width - self.cell_width) // 2
-                jacket_canvas.paste(resized_jacket, (-left_offset, 0))
-            else:
-                # 图片比单元格更高，基于宽度调整
-                new_width = self.cell_width
-                new_height = int(new_width / aspect_ratio)
-                resized_jacket = jacket.resize((new_width, new_height))
-                
-                # 计算居中位置
-                top_offset = (new_height - self.cell_height) // 2
-                jacket_canvas.paste(resized_jacket, (0, -top_offset))
-                
-            # 应用高斯模糊
-            jacket_canvas = jacket_canvas.filter(ImageFilter.GaussianBlur(4))
-            
-            # 粘贴到主图像
-            self.base_image.paste(jacket_canvas, (x, y))
+        return self.fallback_jacket
+
+    def get_cover(self, music_id):
+        """获取缩放到单元格封面尺寸的封面，解码和缩放结果按封面签名缓存"""
+        key = (music_id, self.jacket_store.signature(music_id), (self.cell_width, self.cell_height))
+        def build():
+            jacket = self.get_jacket(music_id)
+            return self.fit_jacket(jacket) if jacket else None
+        return self.jacket_cache.get_or_build(key, build)
+
+    def cover_size(self, jacket_size):
+        """使用fill而不是stretch：计算封面覆盖整个单元格所需的缩放尺寸"""
+        width, height = jacket_size
+        aspect_ratio = width / height
+        target_ratio = self.cell_width / self.cell_height
+        if aspect_ratio > target_ratio:
+            # 图片比单元格更宽，基于高度调整
+            return int(self.cell_height * aspect_ratio), self.cell_height
+        # 图片比单元格更高，基于宽度调整
+        return self.cell_width, int(self.cell_width / aspect_ratio)
+
+    def fit_jacket(self, jacket):
+        """将封面缩放到单元格封面尺寸"""
+        return jacket.resize(self.cover_size(jacket.size))
+
+    def render_cell_background(self, jacket, fitted=False):
+        """将封面居中裁剪为单元格大小并模糊，作为单元格背景；fitted表示封面已经过fit_jacket缩放"""
+        if not fitted:
+            jacket = self.fit_jacket(jacket)
+        
+        # 首先创建一个空白画布，居中粘贴缩放后的封面
+        jacket_canvas = Image.new('RGB', (self.cell_width, self.cell_height))
+        left_offset = (jacket.width - self.cell_width) // 2
+        top_offset = (jacket.height - self.cell_height) // 2
+        jacket_canvas.paste(jacket, (-left_offset, -top_offset))
             
-        # 绘制半透明遮罩
-        overlay = Image.new('RGBA', (self.cell_width, self.cell_height), (0, 0, 0, 128))
-        self.base_image.paste(overlay, (x, y), overlay)
+        # 应用高斯模糊
+        return jacket_canvas.filter(ImageFilter.GaussianBlur(self.jacket_blur_radius))
+
+    def apply_cell_overlay(self, background):
+        """在单元格背景上叠加半透明遮罩"""
+        background = background.copy()
+        background.paste(self.cell_overlay, (0, 0), self.cell_overlay)
+        return background
+
+    def get_cell_background(self, music_id):
+        """获取带遮罩的单元格背景，优先使用已模糊的缓存"""
+        key = (music_id, (self.cell_width, self.cell_height), self.jacket_blur_radius, TEMPLATE_VERSION)
+        signature = self.jacket_store.signature(music_id)
+        background = self.tile_cache.get(key, signature)
+        if background is None:
+            cover = self.get_cover(music_id)
+            if not cover:
+                # 没有封面时只在底色上叠加遮罩
+                return self._cached_effect(
+                    ('empty_cell', self.cell_width, self.cell_height, self.background_color),
+                    lambda: self.apply_cell_overlay(Image.new('RGB', (self.cell_width, self.cell_height), self.background_color)))
+            background = self.apply_cell_overlay(self.render_cell_background(cover, fitted=True))
+            self.tile_cache.put(key, signature, background)
+        return background
+
+    def render_cell_tile(self, song_data, tile_size=None, background=None):
+        """
+        将单个歌曲格子渲染为独立的图块。
+        tile_size大于格子尺寸时，多出的部分保留背景色，用于容纳溢出格子的文字和颜色条
+        background: 已准备好的单元格背景，为None时按封面生成
+        """
+        tile = Image.new('RGB', tile_size or (self.cell_width, self.cell_height), self.background_color)
+        draw = ImageDraw.Draw(tile)
+        
+        # 背景中已包含半透明遮罩；来自共享图集的RGBX背景在粘贴时转换为RGB
+        if background is None:
+            background = self.get_cell_background(song_data['music']['music_id'])
+        tile.paste(background, (0, 0))
         
         # 绘制难度颜色条 - 放在左侧
         diff_color = self.get_difficulty_color(song_data['difficulty'])
-        draw.rectangle([x, y, x + 10, y + self.cell_height], fill=diff_color)  # 原5*2
+        draw.rectangle([0, 0, self.px(10), self.cell_height], fill=diff_color)  # 原5*2
         
         # 绘制难度图标 - 放在左上角
-        diff_image = self.get_difficulty_image(song_data['difficulty'])
-        if diff_image:
-            # 调整难度图标大小
-            diff_size = (232, 30)  # 原(116, 15)*2
-            diff_image = diff_image.resize(diff_size)
-            diff_pos_x = x + 32  # 原16*2
-            diff_pos_y = y + 20  # 原10*2
-            self.base_image.paste(diff_image, (diff_pos_x, diff_pos_y), diff_image if diff_image.mode == 'RGBA' else None)
+        diff_sprite = self.icon_atlas.difficulty_sprite(self.difficulty_names.get(song_data['difficulty'], "master"))
+        if diff_sprite:
+            diff_pos_x = self.px(32)  # 原16*2
+            diff_pos_y = self.px(20)  # 原10*2
+            tile.paste(diff_sprite[0], (diff_pos_x, diff_pos_y), diff_sprite[1])
         
         # 绘制文字信息 - 将所有文本下移，避免与难度指示器冲突
-        text_x = x + 32  # 原16*2
-        text_y = y + 60  # 原30*2
+        text_x = self.px(32)  # 原16*2
+        text_y = self.px(60)  # 原30*2
         
         # 歌曲名称（限制长度并添加省略号）
         name = song_data['music']['name']
@@ -502,7 +1984,7 @@ class B55GramGenerator:
         if len(name) > max_chars:
             name = name[:max_chars-2] + "..."
             
-        draw.text((text_x, text_y+3), name, 
+        draw.text((text_x, text_y + self.px(3)), name, 
                  font=self.font, fill="white")
         
         # 分数和等级
@@ -514,32 +1996,147 @@ class B55GramGenerator:
         rating_text = f"Base: {base} -> {rating}"
         
         score_text = "{:,}".format(int(score_text))  # Add commas to separate every three digits
-        draw.text((text_x, text_y + 30), score_text,  # 原16*2
-                 font=ImageFont.truetype("assets/fonts/Torus-SemiBold.otf", 46), fill="white")  # 原23*2
-        draw.text((text_x, text_y + 93), rating_text,  # 原45*2
-                 font=ImageFont.truetype("assets/fonts/combined.ttf", 30), fill="white")  # 原15*2
+        self.draw_number_text(tile, draw, (text_x, text_y + self.px(30)), score_text,  # 原16*2
+                              FontRegistry.get("assets/fonts/Torus-SemiBold.otf", self.px(46)))  # 原23*2
+        self.draw_number_text(tile, draw, (text_x, text_y + self.px(93)), rating_text,  # 原45*2
+                              FontRegistry.get("assets/fonts/combined.ttf", self.px(30)))  # 原15*2
                  
         # 绘制等级图标 - 放在右下角
-        rank_image = self.get_rank_image(score)
-        if rank_image:
-            # 调整等级图标大小
-            rank_size = (100, 50)  # 原(50, 25)*2
-            rank_image = rank_image.resize(rank_size)
-            rank_pos_x = x + self.cell_width - rank_size[0] - 14  # 原7*2
-            rank_pos_y = y + self.cell_height - rank_size[1] - 54  # 原30*2
-            self.base_image.paste(rank_image, (rank_pos_x, rank_pos_y), rank_image if rank_image.mode == 'RGBA' else None)
-       
+        rank_sprite = self.icon_atlas.rank_sprite(score)
+        if rank_sprite:
+            rank_size = self.rank_icon_size
+            rank_pos_x = self.cell_width - rank_size[0] - self.px(14)  # 原7*2
+            rank_pos_y = self.cell_height - rank_size[1] - self.px(54)  # 原30*2
+            tile.paste(rank_sprite[0], (rank_pos_x, rank_pos_y), rank_sprite[1])
+        
+        return tile
+
+    def cell_tile_key(self, song_data, tile_size):
+        """
+        单元格图块的内容哈希：包含所有会影响图块像素的输入，
+        封面签名变化或修改模板版本后自动失效
+        """
+        music_id = song_data['music']['music_id']
+        self.wait_for_jacket(music_id)
+        font_path = getattr(self.font, 'path', 'default')
+        content = (
+            TEMPLATE_VERSION, self.assets.signature, self.scale, self.cell_width, self.cell_height, tuple(tile_size or (self.cell_width, self.cell_height)),
+            self.background_color, self.jacket_blur_radius, font_path,
+            music_id, song_data['music']['name'], song_data['difficulty'], song_data['score'], song_data['rating'],
+            self.jacket_store.signature(music_id),
+        )
+        return hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+    def draw_number_text(self, image, draw, xy, text, font, fill="white"):
+        """绘制分数、rating等数字文字：优先使用字形图集，图集不支持时使用draw.text"""
+        atlas = GlyphAtlas.get(font)
+        if atlas is None or not atlas.draw_text(image, xy, text, fill):
+            draw.text(xy, text, font=font, fill=fill)
+
+    def draw_song_cell(self, draw, x, y, song_data):
+        """绘制单个歌曲格子"""
+        self.base_image.paste(self.render_cell_tile(song_data), (x, y))
+
+    def _get_render_executor(self):
+        """延迟创建单元格渲染池，在多次生成之间复用"""
+        if self._render_executor is None:
+            if self.render_pool == 'process':
+                # 每个子进程持有自己的生成器（字体、图标、封面缓存），按本生成器的配置创建
+                self._render_executor = ProcessPoolExecutor(max_workers=self.render_workers, initializer=_init_tile_worker,
+                                                            initargs=(self.worker_options(),))
+            else:
+                self._render_executor = ThreadPoolExecutor(max_workers=self.render_workers)
+        return self._render_executor
+
+    def worker_options(self):
+        """进程池子进程重建生成器所需的配置：缩放、布局、资源目录、字体搜索路径、封面包和背景缓存目录"""
+        return {
+            'scale': self.scale,
+            'layout': self.layout,
+            'assets_root': self.assets.root,
+            'font_search_paths': list(FontRegistry.search_paths),
+            'jacket_pack': getattr(self.jacket_store, 'path', None),
+            'tile_cache_dir': self.tile_cache.cache_dir,
+        }
+
+    def render_cell_tiles(self, cells):
+        """
+        获取多个单元格图块，优先使用图块缓存，相同内容的格子只渲染一次，未命中的并发渲染
+        cells: [(song_data, tile_size), ...]，按相同顺序返回图块（可能是共享的缓存对象，不要修改）
+        """
+        keys = [self.cell_tile_key(song_data, tile_size) for song_data, tile_size in cells]
+        tiles = {}
+        missing = {}
+        for key, cell in zip(keys, cells):
+            if key in tiles or key in missing:
+                continue
+            tile = self.cell_cache.get(key)
+            if tile is None:
+                missing[key] = cell
+            else:
+                tiles[key] = tile
+        
+        if missing:
+            for key, tile in zip(missing, self._render_cell_tiles(list(missing.values()))):
+                self.cell_cache.put(key, tile)
+                tiles[key] = tile
+        return [tiles[key] for key in keys]
+
+    def _render_cell_tiles(self, cells):
+        """并发渲染多个单元格图块，render_workers<=1时串行渲染"""
+        if self.render_workers <= 1 or len(cells) <= 1:
+            return [self.render_cell_tile(song_data, tile_size) for song_data, tile_size in cells]
+        
+        executor = self._get_render_executor()
+        song_list = [song_data for song_data, _ in cells]
+        tile_sizes = [tile_size for _, tile_size in cells]
+        if self.render_pool == 'process':
+            # 背景由当前进程准备好写入共享图集，子进程只负责绘制文字和图标
+            atlas = self.get_background_atlas()
+            backgrounds = [atlas.ensure((song_data['music']['music_id'], self.jacket_store.signature(song_data['music']['music_id'])),
+                                        lambda music_id=song_data['music']['music_id']: self.get_cell_background(music_id))
+                           for song_data in song_list]
+            chunksize = max(1, len(cells) // (self.render_workers * 4))
+            results = executor.map(_render_tile_in_worker, song_list, tile_sizes, backgrounds, chunksize=chunksize)
+            return [Image.frombytes('RGB', size, data) for size, data in results]
+        return list(executor.map(self.render_cell_tile, song_list, tile_sizes))
+
+    def get_background_atlas(self):
+        """获取与子进程共享的背景图集，超过容量后换用新的图集"""
+        with self.cache_lock:
+            if self._background_atlas is not None and self._background_atlas.full:
+                self._background_atlas.close()
+                self._background_atlas = None
+            if self._background_atlas is None:
+                self._background_atlas = BackgroundAtlas((self.cell_width, self.cell_height))
+            return self._background_atlas
+
+    def close(self):
+        """关闭单元格渲染池和封面预取器"""
+        if self._render_executor is not None:
+            self._render_executor.shutdown()
+            self._render_executor = None
+        if self._background_atlas is not None:
+            self._background_atlas.close()
+            self._background_atlas = None
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
 
     def draw_section_title(self, draw, x, y, title, rating=None):
         """绘制区段标题"""
-        draw.text((x, y - 34), title, font=self.title_font, fill="white")  # 原17*2
+        draw.text((x, y - self.px(34)), title, font=self.title_font, fill="white")  # 原17*2
         if rating is not None:
-            rating_text = f"{rating:.2f}"
-            # 计算标题宽度以便将rating放在右侧
-            title_width = self.title_font.getsize(title)[0] if hasattr(self.title_font, 'getsize') else self.title_font.getbbox(title)[2]
-            # 从右往左对齐，空30pc
-            rating_width = self.title_font.getsize(rating_text)[0] if hasattr(self.title_font, 'getsize') else self.title_font.getbbox(rating_text)[2]
-            draw.text((x + 1800, y - 34), rating_text, font=self.title_font, fill="white")  # 原900*2, 17*2
+            self.draw_section_rating(draw, x, y, rating)
+
+    def draw_section_rating(self, draw, x, y, rating):
+        """在区段标题右侧绘制区段rating"""
+        rating_text = f"{rating:.2f}"
+        draw.text(self.section_rating_pos(x, y), rating_text, font=self.title_font, fill="white")
+
+    def section_rating_pos(self, x, y):
+        """区段rating文字的位置"""
+        return x + self.px(1800), y - self.px(34)  # 原900*2, 17*2
 
     def get_rating_color(self, rating):
         """根据rating值返回对应的颜色"""
@@ -566,58 +2163,68 @@ class B55GramGenerator:
 
     
 
+    # 彩虹文字和横幅渐变的缓存，所有生成器共享
+    _effect_cache = ImageLRU(64)
+    # 每种布局（图像尺寸、区段标题位置）的静态模板层，整张图较大，只保留少量
+    _template_cache = ImageLRU(4)
+    # 超过这个像素数的模板层（如全部记录）不缓存，每次直接绘制到主图像上
+    max_cached_template_pixels = 4000 * 4000
+    # 布局计划：每种(布局, 缩放比例, 各区段歌曲数, 是否有玩家信息)的标题和单元格位置
+    _plan_cache = ImageLRU(64)
+
+    @classmethod
+    def _cached_effect(cls, key, builder):
+        """按key缓存生成好的特效图层"""
+        return cls._effect_cache.get_or_build(key, builder)
+
+    @staticmethod
+    def horizontal_gradient(width, height, start_color, end_color, start_x, end_x):
+        """生成水平渐变：start_x之前为起始色，end_x之后为结束色，中间线性插值"""
+        ratio = np.clip((np.arange(width) - start_x) / float(end_x - start_x), 0, 1)[:, None]
+        row = (np.array(start_color) * (1 - ratio) + np.array(end_color) * ratio).astype(np.uint8)
+        return Image.fromarray(np.ascontiguousarray(np.broadcast_to(row, (height, width, 3))), 'RGB')
+
     def create_rainbow_text_v4(self, text, font, width, height):
         """使用更简单的方法创建彩虹渐变文字，带有黑色描边效果"""
+        key = ('rainbow', text, getattr(font, 'path', id(font)), getattr(font, 'size', None), width, height)
+        return self._cached_effect(key, lambda: self._build_rainbow_text(text, font, width, height))
+
+    def _build_rainbow_text(self, text, font, width, height):
+        """生成彩虹文字图层：渐变按行向量化计算，描边由文字蒙版膨胀得到"""
         # 创建三个不同颜色的文字图层
-        colors = [
+        colors = np.array([
             (247, 254, 18),    # 黄色 #f7fe12
             (0, 255, 255),     # 青色 #0ff
             (254, 112, 211)    # 粉色 #fe70d3
-        ]
-        
-        # 创建基础文字图层
-        text_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(text_layer)
+        ], dtype=np.float64)
         
         # 获取文字大小并计算居中位置
-        bbox = draw.textbbox((0, 0), text, font=font)
+        mask = Image.new('L', (width, height), 0)
+        mask_draw = ImageDraw.Draw(mask)
+        bbox = mask_draw.textbbox((0, 0), text, font=font)
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
         x = (width - text_width) // 2
         y = (height - text_height) // 2
         
-        # 创建描边层
-        outline_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        outline_draw = ImageDraw.Draw(outline_layer)
-        
-        # 绘制描边（通过在四个方向各偏移1px来实现）
-        offsets = [(0, 1), (0, -1), (1, 0), (-1, 0),  # 上下左右
-                  (1, 1), (1, -1), (-1, 1), (-1, -1)]  # 对角线
-        for offset_x, offset_y in offsets:
-            outline_draw.text((x + offset_x, y + offset_y), text, font=font, fill=(70, 70, 70, 255))
-        
-        # 绘制主文字
-        draw.text((x, y), text, font=font, fill="white")
+        # 只光栅化一次文字，得到文字蒙版
+        mask_draw.text((x, y), text, font=font, fill=255)
+        text_layer = Image.merge('RGBA', (Image.new('L', (width, height), 255),) * 3 + (mask,))
         
-        # 创建渐变图层
-        gradient = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        gradient_draw = ImageDraw.Draw(gradient)
+        # 描边：将文字蒙版向八个方向膨胀1px
+        outline_alpha = mask.filter(ImageFilter.MaxFilter(3))
+        outline_layer = Image.merge('RGBA', (Image.new('L', (width, height), 70),) * 3 + (outline_alpha,))
         
-        # 绘制渐变
+        # 绘制渐变：0-45%为黄色，之后从青色过渡到粉色
         offset = -3  # 添加偏移量，与create_rainbow_gradient_test保持一致
-        for y_pos in range(height):
-            # 计算当前位置的相对高度
-            rel_pos = (y_pos + offset) / height
-            
-            seperation = 0.45
-            # 确定当前位置的颜色
-            if rel_pos < seperation:  # 0-40% 黄色
-                color = colors[0]
-            else:
-                ratio = (rel_pos - seperation) / (.6 - seperation)
-                color = tuple(int(colors[1][i] * (1 - ratio) + colors[2][i] * ratio) for i in range(3))
-            
-            gradient_draw.line([(0, y_pos), (width, y_pos)], fill=color + (255,))
+        seperation = 0.45
+        rel_pos = (np.arange(height) + offset) / height
+        ratio = ((rel_pos - seperation) / (.6 - seperation))[:, None]
+        rows = (colors[1] * (1 - ratio) + colors[2] * ratio).astype(np.int64)
+        rows[rel_pos < seperation] = colors[0]
+        rows = np.clip(rows, 0, 255).astype(np.uint8)
+        gradient_rows = np.concatenate([rows, np.full((height, 1), 255, dtype=np.uint8)], axis=1)
+        gradient = Image.fromarray(np.ascontiguousarray(np.broadcast_to(gradient_rows[:, None, :], (height, width, 4))), 'RGBA')
         
         # 创建最终结果图层
         result = Image.new('RGBA', (width, height), (0, 0, 0, 0))
@@ -635,39 +2242,42 @@ class B55GramGenerator:
     
     def draw_player_profile(self, draw, player_data):
         """绘制玩家个人信息"""
-        # 加载用户头像
-        avatar_path = player_data['data'].get('avatar_path')
-        
-        # 创建一个新的图层用于渐变效果
-        gradient = Image.new('RGBA', (self.cell_width * self.grid_width, self.profile_height))
-        gradient_draw = ImageDraw.Draw(gradient)
-        
-        # 定义颜色
+        self.draw_profile_chrome(self.base_image, draw)
+        self.draw_profile_details(draw, player_data)
+
+    def draw_profile_chrome(self, image, draw):
+        """绘制个人信息区域中与玩家无关的部分（横幅、昵称背景、RATING标签）"""
+        # 创建渐变效果：在800px处开始渐变，持续400px（原400*2, 600*2）
         white = (255, 255, 255)
         pink = (255, 255, 255)
-        
-        # 创建渐变效果
-        for x in range(self.cell_width * self.grid_width):
-            # 在800px处开始渐变，持续400px
-            if x < 800:  # 原400*2
-                color = white
-            elif x < 1200:  # 原600*2
-                # 线性插值计算颜色
-                ratio = (x - 800) / 400.0  # 原(400, 200)*2
-                r = int(white[0] * (1 - ratio) + pink[0] * ratio)
-                g = int(white[1] * (1 - ratio) + pink[1] * ratio)
-                b = int(white[2] * (1 - ratio) + pink[2] * ratio)
-                color = (r, g, b)
-            else:
-                color = pink
-            gradient_draw.line([(x, 0), (x, self.profile_height)], fill=color)
+        banner_size = (self.cell_width * self.grid_width, self.profile_height)
+        gradient = self._cached_effect(
+            ('banner',) + banner_size + (white, pink),
+            lambda: self.horizontal_gradient(banner_size[0], banner_size[1], white, pink, self.px(800), self.px(1200)))
         
         # 将渐变图层粘贴到主图像
-        self.base_image.paste(gradient, (0, 0))
+        image.paste(gradient, (0, 0))
         
         # 为玩家昵称绘制背景
-        draw.rectangle((274, 100, 724, 180), fill=(50, 50, 50, 255))  # 原(137, 50, 362, 90)*2
+        draw.rectangle(self.px((274, 100, 724, 180)), fill=(50, 50, 50, 255))  # 原(137, 50, 362, 90)*2
         
+        # 绘制"RATING"文字
+        draw.text(self.px((280, 215)), f"RATING", font=FontRegistry.get("assets/fonts/combined.ttf", self.px(46)), fill=(50, 50, 50))  # 原(140, 100)*2, 23*2
+
+    def load_avatar(self, avatar_path):
+        """加载头像并裁剪为圆形，处理结果按文件缓存"""
+        if avatar_path and os.path.exists(avatar_path):
+            source_path = avatar_path
+        elif os.path.exists('assets/default_avatar.webp'):
+            source_path = 'assets/default_avatar.webp'
+        else:
+            source_path = None
+        signature = JacketTileCache.source_signature(source_path) if source_path else None
+        size = self.px(200)  # 原100*2
+        return self._cached_effect(('avatar', source_path, signature, size), lambda: self._build_avatar(avatar_path, size))
+
+    def _build_avatar(self, avatar_path, size=200):
+        """生成size x size的圆形头像"""
         # 尝试加载头像，如果失败则创建默认头像
         avatar = None
         if avatar_path and os.path.exists(avatar_path):
@@ -699,132 +2309,121 @@ class B55GramGenerator:
                 # 绘制圆形头像
                 draw_avatar.ellipse((20, 20, 180, 180), fill=(150, 150, 150, 255))  # 原(10, 10, 90, 90)*2
         
-        # 调整头像大小为200x200
-        avatar = avatar.resize((200, 200), Image.Resampling.LANCZOS)  # 原(100, 100)*2
+        # 调整头像大小
+        avatar = avatar.resize((size, size), Image.Resampling.LANCZOS)
         
         # 创建一个圆形蒙版
-        mask = Image.new('L', (200, 200), 0)  # 原(100, 100)*2
+        mask = Image.new('L', (size, size), 0)
         mask_draw = ImageDraw.Draw(mask)
-        mask_draw.ellipse((0, 0, 200, 200), fill=255)  # 原(0, 0, 100, 100)*2
+        mask_draw.ellipse((0, 0, size, size), fill=255)
         
         # 创建一个新的RGBA图像用于头像
-        avatar_with_mask = Image.new('RGBA', (200, 200), (0, 0, 0, 0))  # 原(100, 100)*2
+        avatar_with_mask = Image.new('RGBA', (size, size), (0, 0, 0, 0))
         # 使用圆形蒙版粘贴头像
         avatar_with_mask.paste(avatar, (0, 0), mask)
         
+        return avatar_with_mask
+
+    def draw_profile_details(self, draw, player_data):
+        """绘制个人信息区域中与玩家相关的部分（头像、等级、昵称、Rating）"""
+        # 加载用户头像
+        avatar_with_mask = self.load_avatar(player_data['data'].get('avatar_path'))
+        
         # 粘贴到主图像，使用alpha通道作为蒙版
-        self.base_image.paste(avatar_with_mask, (40, 20), avatar_with_mask)  # 原(20, 10)*2
+        self.base_image.paste(avatar_with_mask, self.px((40, 20)), avatar_with_mask)  # 原(20, 10)*2
         
         # 绘制玩家名称
         user_name = player_data['data'].get('user_name', '未知玩家')
         level = player_data['data'].get('level', '??') + player_data['data'].get('reincarnation_num', '??') * 100
-        draw.text((280, 30), f"Lv.{level}", font=ImageFont.truetype("assets/fonts/combined.ttf", 60), fill=(50, 50, 50))  # 原(140, 10)*2, 30*2
-        draw.text((284, 120), user_name, font=ImageFont.truetype("assets/fonts/combined.ttf", 60), fill=(255, 255, 255))  # 原(142, 55)*2, 30*2
+        name_font = FontRegistry.get("assets/fonts/combined.ttf", self.px(60))  # 原30*2
+        draw.text(self.px((280, 30)), f"Lv.{level}", font=name_font, fill=(50, 50, 50))  # 原(140, 10)*2
+        draw.text(self.px((284, 120)), user_name, font=name_font, fill=(255, 255, 255))  # 原(142, 55)*2
         
         # 绘制Rating
         player_rating = player_data['data'].get('player_rating', 0) / 100 if 'player_rating' in player_data['data'] else 0
-        rating_font = ImageFont.truetype("assets/fonts/combined.ttf", 70)  # 原30*2
-        
-        # 绘制"RATING"文字
-        draw.text((280, 215), f"RATING", font=ImageFont.truetype("assets/fonts/combined.ttf", 46), fill=(50, 50, 50))  # 原(140, 100)*2, 23*2
+        rating_font = FontRegistry.get("assets/fonts/combined.ttf", self.px(70))  # 原30*2
         
         # 创建彩虹渐变文字
         rating_text = f"{player_rating:.2f}"
-        rainbow_text = self.create_rainbow_text_v4(rating_text, rating_font, 430, 130)  # 原(200, 40)*2
-        self.base_image.paste(rainbow_text, (420, 155), rainbow_text)  # 原(170, 83)*2
+        rainbow_text = self.create_rainbow_text_v4(rating_text, rating_font, *self.rating_badge_size)
+        self.base_image.paste(rainbow_text, self.rating_badge_pos, rainbow_text)
 
-    def generate(self, json_data, player_data=None):
-        """生成B55表格图像"""
-        # 获取各个部分的数据
-        best_scores = json_data['data']['best_rating_list']
-        new_scores = json_data['data']['best_new_rating_list']
-        recent_scores = json_data['data']['hot_rating_list']
-        
-        # 按rating值排序
-        best_scores = sorted([s for s in best_scores if s['rating'] > 0], key=lambda x: x['rating'], reverse=True)
-        new_scores = sorted([s for s in new_scores if s['rating'] > 0], key=lambda x: x['rating'], reverse=True)
-        recent_scores = sorted([s for s in recent_scores if s['rating'] > 0], key=lambda x: x['rating'], reverse=True)
-        
-        # 预加载所有需要的封面
-        all_songs = best_scores[:30] + new_scores[:15] + recent_scores[:10]
-        self.preload_jackets(all_songs)
-        
-        # 计算每个部分最多显示多少歌曲（确保总共最多显示55首）
-        max_best = min(30, len(best_scores))  # 最佳最多30首
-        max_new = min(15, len(new_scores))    # 新曲最多15首
-        max_recent = min(10, len(recent_scores))  # 最近最多10首
-        
-        # 计算每个部分需要的行数
-        best_rows = math.ceil(max_best / self.grid_width)
-        new_rows = math.ceil(max_new / self.grid_width)
-        recent_rows = math.ceil(max_recent / self.grid_width)
-        
-        # 计算图像总高度（包括玩家信息、每部分标题和间距）
-        total_height = (
-            self.profile_height +  # 顶部玩家信息
-            self.section_padding +  # 顶部留空
-            self.title_font_size + 10 +  # "最佳"标题和间距
-            best_rows * self.cell_height +
-            self.section_padding +  # "最佳"与"新曲"之间的间距
-            self.title_font_size + 10 +  # "新曲"标题和间距
-            new_rows * self.cell_height +
-            self.section_padding +  # "新曲"与"最近"之间的间距
-            self.title_font_size + 10 +  # "最近"标题和间距
-            recent_rows * self.cell_height +
-            self.section_padding + 40  # 底部留空
-        )
-        
-        # 创建基础图像
-        width = self.cell_width * self.grid_width
-        self.base_image = Image.new('RGB', (width, total_height), (32, 32, 32))
-        draw = ImageDraw.Draw(self.base_image)
-        
-        # 绘制玩家信息
-        if player_data:
-            self.draw_player_profile(draw, player_data)
-            # 更新y偏移量，从玩家信息下方开始绘制歌曲
-            y_offset_start = self.profile_height
-        else:
-            y_offset_start = 0
-        
-        # 获取rating值
-        best_rating = json_data['data']['best_rating'] / 100
-        new_rating = json_data['data']['best_new_rating'] / 100
-        recent_rating = json_data['data']['hot_rating'] / 100
-        
-        # 绘制"最佳"部分
-        y_offset = y_offset_start + self.section_padding
-        self.draw_section_title(draw, 40, y_offset + 10, "BEST", best_rating)
-        y_offset += self.title_font_size + 10
-        
-        for i, song_data in enumerate(best_scores[:max_best]):
+    def _layout_section(self, count, y_offset, width):
+        """计算区段内每个单元格的位置，返回((x, y, tile_size, open_below), ...)"""
+        cells = []
+        for i in range(count):
             x = (i % self.grid_width) * self.cell_width
             y = y_offset + (i // self.grid_width) * self.cell_height
-            self.draw_song_cell(draw, x, y, song_data)
-        
-        # 绘制"新曲"部分
-        y_offset += best_rows * self.cell_height + self.section_padding
-        self.draw_section_title(draw, 40, y_offset + 10, "NEW", new_rating)
-        y_offset += self.title_font_size + 10
-        
-        for i, song_data in enumerate(new_scores[:max_new]):
-            x = (i % self.grid_width) * self.cell_width
-            y = y_offset + (i // self.grid_width) * self.cell_height
-            self.draw_song_cell(draw, x, y, song_data)
+            # 相邻格子会覆盖溢出到其区域的内容；区段最后一个格子右侧为空，
+            # 图块延伸到图像右边缘以保留溢出的文字
+            tile_width = width - x if i == count - 1 else self.cell_width
+            # 下方没有格子时，颜色条多出的1像素会保留下来
+            open_below = i + self.grid_width >= count
+            cells.append((x, y, (tile_width, self.cell_height), open_below))
+        return tuple(cells)
+
+    def plan_layout(self, counts, has_profile):
+        """
+        根据布局配置和各区段的歌曲数计算整张图的尺寸、区段标题和每个单元格的位置。
+        结果只与配置、缩放比例和歌曲数有关，按这些参数缓存，所有生成器共享
+        返回: {'width', 'height', 'titles': ((x, y, 标题), ...), 'sections': (区段单元格, ...)}
+        """
+        key = (self.layout_key, self.scale, tuple(counts), bool(has_profile))
+        return self._plan_cache.get_or_build(key, lambda: self._build_plan(counts, has_profile))
+
+    def _build_plan(self, counts, has_profile):
+        layout = self.layout
+        width = self.cell_width * self.grid_width
+        title_spacing = self.px(layout['title_spacing'])
+        titles = []
+        sections = []
+        y_offset = self.profile_height if has_profile else 0
+        for section, count in zip(layout['sections'], counts):
+            y_offset += self.section_padding
+            titles.append((self.px(layout['title_x']), y_offset + title_spacing, section['title']))
+            y_offset += self.title_font_size + title_spacing
+            sections.append(self._layout_section(count, y_offset, width))
+            y_offset += math.ceil(count / self.grid_width) * self.cell_height
+        
+        # 图像总高度：玩家信息（没有玩家信息时也保留这部分高度）、每个区段的间距、标题和单元格，以及底部留空
+        height = self.profile_height + self.section_padding + self.px(layout['bottom_padding'])
+        for count in counts:
+            height += (self.section_padding + self.title_font_size + title_spacing
+                       + math.ceil(count / self.grid_width) * self.cell_height)
+        return {'width': width, 'height': height, 'titles': tuple(titles), 'sections': tuple(sections)}
+
+    def get_template_layer(self, width, total_height, has_profile, titles):
+        """
+        获取某种布局的静态模板层，包含与玩家无关的部分：
+        背景、横幅、昵称背景、RATING标签、区段标题和页脚
+        titles: ((x, y, title), ...)
+        """
+        key = (width, total_height, has_profile, titles)
+        return self._template_cache.get_or_build(key, lambda: self._build_template_layer(width, total_height, has_profile, titles))
+
+    def new_base_image(self, width, total_height, has_profile, titles):
+        """从模板层开始的新主图像；很大的布局不缓存模板层，避免同时占用两份整图内存"""
+        if width * total_height > self.max_cached_template_pixels:
+            return self._build_template_layer(width, total_height, has_profile, titles)
+        return self.get_template_layer(width, total_height, has_profile, titles).copy()
+
+    def _build_template_layer(self, width, total_height, has_profile, titles):
+        template = Image.new('RGB', (width, total_height), self.background_color)
+        draw = ImageDraw.Draw(template)
         
-        # 绘制"最近"部分
-        y_offset += new_rows * self.cell_height + self.section_padding
-        self.draw_section_title(draw, 40, y_offset + 10, "RECENT", recent_rating)
-        y_offset += self.title_font_size + 10
+        if has_profile:
+            self.draw_profile_chrome(template, draw)
         
-        for i, song_data in enumerate(recent_scores[:max_recent]):
-            x = (i % self.grid_width) * self.cell_width
-            y = y_offset + (i // self.grid_width) * self.cell_height
-            self.draw_song_cell(draw, x, y, song_data)
+        for x, y, title in titles:
+            self.draw_section_title(draw, x, y, title)
         
-        # 添加底部文字
+        self.draw_footer(draw, width, total_height)
+        return template
+
+    def draw_footer(self, draw, width, bottom):
+        """在图像底部居中绘制页脚，bottom为图像底边的y坐标"""
         footer_text = "Designed by Kcalb_MengWang | Generated by CornBot Powered by Kohakuwu"
-        footer_font = ImageFont.truetype("assets/fonts/Torus-SemiBold.otf", 36)  # 使用较小的字号
+        footer_font = FontRegistry.get("assets/fonts/Torus-SemiBold.otf", self.px(36))  # 使用较小的字号
         
         # 获取文字大小
         bbox = draw.textbbox((0, 0), footer_text, font=footer_font)
@@ -832,14 +2431,511 @@ class B55GramGenerator:
         
         # 计算居中位置
         x = (width - text_width) // 2
-        y = total_height - self.section_padding // 2  # 在底部padding的中间位置
+        y = bottom - self.section_padding // 2  # 在底部padding的中间位置
         
         # 绘制文字
-        draw.text((x, y - 45), footer_text, font=footer_font, fill=(180, 180, 180))  # 使用浅灰色
+        draw.text((x, y - self.px(45)), footer_text, font=footer_font, fill=(180, 180, 180))  # 使用浅灰色
+
+    def section_songs(self, json_data):
+        """按布局配置取出每个区段显示的歌曲，返回[(区段配置, 歌曲列表), ...]"""
+        data = json_data['data']
+        result = []
+        for section in self.layout['sections']:
+            sources = section['source']
+            if isinstance(sources, str):
+                songs = data[sources]
+            else:
+                # 合并多个列表，同一谱面只保留第一次出现的记录
+                songs = []
+                seen = set()
+                for source in sources:
+                    for song in data[source]:
+                        chart = (song['music']['music_id'], song['difficulty'])
+                        if chart not in seen:
+                            seen.add(chart)
+                            songs.append(song)
+            songs = sorted([s for s in songs if s['rating'] > 0], key=lambda x: x['rating'], reverse=True)
+            result.append((section, songs[:section['limit']]))
+        return result
+
+    def displayed_songs(self, json_data):
+        """图像中显示的所有歌曲，按显示顺序"""
+        return [song for _, songs in self.section_songs(json_data) for song in songs]
+
+    def missing_jackets(self, json_data):
+        """图像中显示的歌曲里封面包中没有封面的music_id"""
+        music_ids = dict.fromkeys(song['music']['music_id'] for song in self.displayed_songs(json_data))
+        return [music_id for music_id in music_ids if music_id not in self.jacket_store]
+
+    def place_cells(self, json_data, sections, player_data):
+        """
+        布局计划按各区段歌曲数缓存，这里只需把歌曲填入计算好的位置。
+        返回(template_key, titles, cells)，titles: [(x, y, 标题, rating)]，cells: [(x, y, song_data, tile_size, open_below)]
+        """
+        plan = self.plan_layout([len(songs) for _, songs in sections], bool(player_data))
+        titles = []
+        cells = []
+        for (x, y, title), (section, songs), section_cells in zip(plan['titles'], sections, plan['sections']):
+            rating_field = section.get('rating')
+            section_rating = json_data['data'][rating_field] / 100 if rating_field else None
+            titles.append((x, y, title, section_rating))
+            cells += [(cell_x, cell_y, song_data, tile_size, open_below)
+                      for (cell_x, cell_y, tile_size, open_below), song_data in zip(section_cells, songs)]
+        
+        template_key = (plan['width'], plan['height'], bool(player_data), plan['titles'])
+        return template_key, titles, cells
+
+    def generate(self, json_data, player_data=None):
+        """生成B55表格图像"""
+        sections = self.section_songs(json_data)
+        
+        # 按显示顺序开始预加载封面，不等待全部完成：每批单元格渲染前只等待自己的封面
+        all_songs = [song for _, songs in sections for song in songs]
+        prefetch_start = time.time()
+        self._pending_jackets = self.preload_jackets(all_songs, wait=False)
+        
+        template_key, titles, cells = self.place_cells(json_data, sections, player_data)
+        
+        image = None
+        previous = self._previous_render if self.incremental else None
+        if (previous is not None and previous['template_key'] == template_key
+                and len(previous['cell_fingerprints']) == len(cells)):
+            # 布局和单元格数量不变时，只重绘有变化的部分
+            image = self._render_incremental(previous, template_key, titles, cells, player_data)
+            if image is not None and self.verify_incremental:
+                self._verify_incremental(image, template_key, titles, cells, player_data)
+        if image is None:
+            image = self._render_full(template_key, titles, cells, player_data)
+        
+        if self._pending_jackets:
+            self.report_prefetch(self._pending_jackets, prefetch_start)
+            self._pending_jackets = {}
+        
+        if self.incremental:
+            # 保存副本：返回给调用者的图片可能被修改，不能作为下次增量渲染的底图
+            self._previous_render = {
+                'template_key': template_key,
+                'image': image.copy(),
+                'titles': titles,
+                'cell_fingerprints': [self.cell_fingerprint(cell) for cell in cells],
+                'profile_fingerprint': self.profile_fingerprint(player_data),
+            }
+        return image
+
+    def render_cache_key(self, json_data, player_data, encode_options):
+        """
+        整张图的缓存键：只包含会绘制到图上的数据（各区段的rating和显示的歌曲、个人信息），
+        加上模板版本、资源签名、布局、缩放比例、输出参数，以及封面和头像的签名
+        """
+        sections = []
+        for section, songs in self.section_songs(json_data):
+            rating_field = section.get('rating')
+            sections.append((json_data['data'][rating_field] if rating_field else None, [
+                (song['music']['music_id'], song['music']['name'], song['difficulty'], song['score'], song['rating'],
+                 self.jacket_store.signature(song['music']['music_id']))
+                for song in songs
+            ]))
+        payload = {
+            'template': TEMPLATE_VERSION,
+            'assets': self.assets.signature,
+            'layout': self.layout_key,
+            'scale': self.scale,
+            'encode': encode_options,
+            'sections': sections,
+            'profile': self.profile_fingerprint(player_data),
+        }
+        normalized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def render_cached(self, json_data, player_data=None, output=None, **encode_options):
+        """
+        生成并编码图像，结果按render_cache_key缓存：输入没有变化时直接返回缓存的编码结果。
+        有封面缺失（使用默认封面）时不读取也不写入缓存，每次都重新渲染并尝试下载缺失的封面。
+        output: 文件路径、可写的流，或None；encode_options传给encode_image
+        返回: encode_image的结果，另有'cached'表示是否命中缓存
+        """
+        fmt = encode_options['fmt'] = resolve_output_format(output, encode_options.get('fmt'))
+        start_time = time.perf_counter()
+        self.jacket_store.refresh()
+        data = None
+        if not self.missing_jackets(json_data):
+            data = self.render_cache.get(self.render_cache_key(json_data, player_data, encode_options), fmt)
+        if data is not None:
+            result = {'format': fmt, 'data': data, 'size': len(data), 'encode_time': time.perf_counter() - start_time, 'cached': True}
+        else:
+            image = self.generate(json_data, player_data)
+            result = encode_image(image, None, **encode_options)
+            result['cached'] = False
+            # 渲染过程中可能下载了缺失的封面，按渲染后的状态判断和计算键
+            if not self.missing_jackets(json_data):
+                self.render_cache.put(self.render_cache_key(json_data, player_data, encode_options), fmt, result['data'])
+        
+        if isinstance(output, str):
+            write_file_atomic(output, result['data'])
+        elif output is not None:
+            output.write(result['data'])
+        if output is not None:
+            result['data'] = None
+        return result
+
+    def render_many(self, snapshots, output=None, workers=4, encode_options=None):
+        """
+        批量渲染多个玩家，所有玩家共享字体、图标、封面和图块缓存。
+        snapshots: [(名称, json_data, player_data), ...]
+        output: 回调函数output(名称, 图像)，或输出目录（按encode_options编码保存为"名称.扩展名"），
+                为None时返回所有图像
+        先一次性预取所有玩家需要的封面的并集，再由workers个线程并发渲染，每个线程使用各自的生成器，
+        渲染完成的图像立即交给output，不在内存中累积。
+        返回: {'count', 'failed', 'elapsed', 'images_per_second', 'images', 'errors'}
+        """
+        snapshots = list(snapshots)
+        encode_options = dict(encode_options or {})
+        start_time = time.perf_counter()
+        
+        if isinstance(output, str) and not os.path.exists(output):
+            os.makedirs(output)
+        
+        # 预取所有玩家封面的并集，渲染时各线程只等待自己用到的封面
+        all_songs = [song for _, json_data, _ in snapshots for song in self.displayed_songs(json_data)]
+        prefetched = self.preload_jackets(all_songs, wait=False)
+        
+        thread_generators = local()
+        generators = []
+        generators_lock = Lock()
+        
+        def render_one(name, json_data, player_data):
+            generator = getattr(thread_generators, 'generator', None)
+            if generator is None:
+                generator = self.clone(render_workers=1, incremental=False)
+                generator._prefetcher = self.get_prefetcher() if prefetched else None
+                generator._pending_jackets = {}
+                thread_generators.generator = generator
+                with generators_lock:
+                    generators.append(generator)
+            image = generator.generate(json_data, player_data)
+            if isinstance(output, str):
+                # 在渲染线程中编码保存，编码和其他玩家的渲染并行进行
+                fmt = encode_options.get('fmt') or 'png'
+                extension = 'jpg' if fmt == 'jpeg' else fmt
+                encode_image(image, os.path.join(output, f"{name}.{extension}"), **encode_options)
+                return None
+            return image
+        
+        images = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(render_one, *snapshot): snapshot[0] for snapshot in snapshots}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    image = future.result()
+                    if callable(output):
+                        output(name, image)
+                    elif output is None:
+                        images[name] = image
+                except Exception as e:
+                    print(f"Error rendering {name}: {e}")
+                    errors[name] = e
+        
+        # 子生成器共享的预取器由当前生成器负责关闭
+        for generator in generators:
+            if generator._prefetcher is self._prefetcher:
+                generator._prefetcher = None
+            generator.close()
+        
+        elapsed = time.perf_counter() - start_time
+        count = len(snapshots) - len(errors)
+        images_per_second = count / elapsed if elapsed > 0 else 0
+        print(f"批量渲染完成: {count}张, 失败: {len(errors)}, 耗时: {elapsed:.2f}秒, {images_per_second:.2f}张/秒")
+        return {
+            'count': count,
+            'failed': len(errors),
+            'elapsed': elapsed,
+            'images_per_second': images_per_second,
+            'images': images,
+            'errors': errors,
+        }
+
+    def _render_full(self, template_key, titles, cells, player_data):
+        """完整渲染整张图像"""
+        # 从静态模板层的副本开始绘制（背景、横幅、区段标题、页脚）
+        self.base_image = self.new_base_image(*template_key)
+        draw = ImageDraw.Draw(self.base_image)
         
+        # 绘制玩家信息
+        if player_data:
+            self.draw_profile_details(draw, player_data)
+        
+        # 绘制各区段的rating
+        for x, y, _, section_rating in titles:
+            if section_rating is not None:
+                self.draw_section_rating(draw, x, y, section_rating)
+        
+        self._draw_cells(draw, cells)
+        return self.base_image
+
+    def _draw_cells(self, draw, cells, redraw=None):
+        """渲染单元格图块并合成到主图像，redraw为需要重绘的单元格下标（None表示全部）"""
+        indexes = list(range(len(cells))) if redraw is None else list(redraw)
+        
+        # 按行分批渲染单元格图块并合成到主图像，前几行的封面到达后即可开始，不必等待全部封面
+        batch_size = self.grid_width * max(1, self.render_workers)
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            tiles = self.render_cell_tiles([(cells[i][2], cells[i][3]) for i in batch])
+            for i, tile in zip(batch, tiles):
+                self.base_image.paste(tile, cells[i][:2])
+        
+        # 难度颜色条的矩形包含下边界，会比格子多出1像素，与逐格绘制保持一致
+        # 重绘的图块可能覆盖其他格子多出的像素，因此总是全部重画
+        for x, y, song_data, _, open_below in cells:
+            if open_below:
+                bar_y = y + self.cell_height
+                draw.rectangle([x, bar_y, x + self.px(10), bar_y], fill=self.get_difficulty_color(song_data['difficulty']))
+
+    def generate_strips(self, json_data, player_data=None, strip_height=None):
+        """
+        按水平条带生成图像，依次返回(y, 条带图像)，拼接后与generate()的结果逐像素一致。
+        每次只持有一个条带和跨越条带边界的单元格图块，内存占用与图像总高度无关。
+        第一次返回前先返回(width, height)，供调用方创建输出
+        strip_height: 条带高度，默认为4行单元格
+        """
+        sections = self.section_songs(json_data)
+        all_songs = [song for _, songs in sections for song in songs]
+        prefetch_start = time.time()
+        self._pending_jackets = self.preload_jackets(all_songs, wait=False)
+        (width, height, _, _), titles, cells = self.place_cells(json_data, sections, player_data)
+        strip_height = strip_height or self.cell_height * 4
+        yield width, height
+        
+        # 个人信息区域在图像顶部，单独绘制一次后按条带裁剪
+        head = None
+        if player_data:
+            head_height = max(self.profile_height, self.rating_badge_pos[1] + self.rating_badge_size[1])
+            self.base_image = head = Image.new('RGB', (width, head_height), self.background_color)
+            draw = ImageDraw.Draw(head)
+            self.draw_profile_chrome(head, draw)
+            self.draw_profile_details(draw, player_data)
+            self.base_image = None
+        
+        cell_tops = [cell[1] for cell in cells]  # 单元格按y坐标排列
+        tiles = {}  # 单元格下标 -> 图块，跨越条带边界的图块留给下一条带使用
+        first = 0
+        for top in range(0, height, strip_height):
+            bottom = min(height, top + strip_height)
+            strip = Image.new('RGB', (width, bottom - top), self.background_color)
+            draw = ImageDraw.Draw(strip)
+            if head is not None and top < head.height:
+                strip.paste(head.crop((0, top, width, min(bottom, head.height))), (0, 0))
+            
+            # 标题、区段rating和页脚按条带的位置平移后绘制，超出条带的部分自动裁剪
+            for x, y, title, section_rating in titles:
+                self.draw_section_title(draw, x, y - top, title, section_rating)
+            self.draw_footer(draw, width, height - top)
+            
+            # 与条带相交的单元格（包括下方多出1像素的颜色条）
+            while first < len(cells) and cells[first][1] + self.cell_height + 1 <= top:
+                first += 1
+            last = bisect_right(cell_tops, bottom - 1)
+            visible = range(first, last)
+            missing = [i for i in visible if i not in tiles]
+            batch_size = self.grid_width * max(1, self.render_workers)
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                for i, tile in zip(batch, self.render_cell_tiles([(cells[i][2], cells[i][3]) for i in batch])):
+                    tiles[i] = tile
+            for i in visible:
+                strip.paste(tiles[i], (cells[i][0], cells[i][1] - top))
+            for i in visible:
+                x, y, song_data, _, open_below = cells[i]
+                if open_below:
+                    bar_y = y + self.cell_height - top
+                    draw.rectangle([x, bar_y, x + self.px(10), bar_y], fill=self.get_difficulty_color(song_data['difficulty']))
+            tiles = {i: tiles[i] for i in visible if cells[i][1] + self.cell_height + 1 > bottom}
+            yield top, strip
+        
+        if self._pending_jackets:
+            self.report_prefetch(self._pending_jackets, prefetch_start)
+            self._pending_jackets = {}
+
+    def render_strips(self, json_data, player_data, output, strip_height=None, fmt=None, compress_level=None, **encode_options):
+        """
+        按条带渲染并直接写出，适合很高的图像（如全部记录）。
+        output为.png文件时流式编码为一张PNG；否则output为目录，每个条带按fmt（默认webp）编码为单独的文件，
+        并写出manifest.json记录图像尺寸和每个条带的位置
+        返回: {'format', 'width', 'height', 'strips', 'size', 'elapsed'}
+        """
+        start_time = time.perf_counter()
+        strips = self.generate_strips(json_data, player_data, strip_height)
+        width, height = next(strips)
+        count = 0
+        if output.lower().endswith('.png'):
+            fmt = 'png'
+            writer = StreamingPNGWriter(output, width, height, 6 if compress_level is None else compress_level)
+            try:
+                for _, strip in strips:
+                    writer.write(strip)
+                    count += 1
+            except Exception:
+                writer.abort()
+                raise
+            writer.close()
+            size = writer.size
+        else:
+            fmt = fmt or 'webp'
+            extension = 'jpg' if fmt == 'jpeg' else fmt
+            if not os.path.exists(output):
+                os.makedirs(output)
+            manifest = {'width': width, 'height': height, 'format': fmt, 'strips': []}
+            size = 0
+            for top, strip in strips:
+                file_name = f"strip_{count:04d}.{extension}"
+                result = encode_image(strip, os.path.join(output, file_name), fmt, compress_level=compress_level, **encode_options)
+                manifest['strips'].append({'file': file_name, 'y': top, 'height': strip.size[1]})
+                size += result['size']
+                count += 1
+            write_file_atomic(os.path.join(output, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf-8'))
+        return {
+            'format': fmt,
+            'width': width,
+            'height': height,
+            'strips': count,
+            'size': size,
+            'elapsed': time.perf_counter() - start_time,
+        }
+
+    def cell_fingerprint(self, cell):
+        """
+        单元格的指纹：位置和图块的内容哈希（包括封面签名），
+        先用默认封面绘制的格子在真正的封面到达后会被重绘
+        """
+        x, y, song_data, tile_size, open_below = cell
+        return (x, y, tile_size, open_below, self.cell_tile_key(song_data, tile_size))
+
+    @staticmethod
+    def profile_fingerprint(player_data):
+        """个人信息区域的指纹"""
+        if not player_data:
+            return None
+        data = player_data['data']
+        avatar_path = data.get('avatar_path')
+        avatar_signature = JacketTileCache.source_signature(avatar_path) if avatar_path else None
+        return (data.get('user_name'), data.get('level'), data.get('reincarnation_num'),
+                data.get('player_rating'), avatar_path, avatar_signature)
+
+    def _render_incremental(self, previous, template_key, titles, cells, player_data):
+        """
+        在上一次渲染结果的基础上，只重绘发生变化的单元格、区段rating和个人信息。
+        需要恢复的区域与单元格重叠时无法保证结果一致，返回None以改为完整渲染
+        """
+        template = self.get_template_layer(*template_key)
+        measure = ImageDraw.Draw(template)
+        
+        # 需要从模板恢复后重绘的区域
+        restore_boxes = []
+        profile_changed = self.profile_fingerprint(player_data) != previous['profile_fingerprint']
+        if player_data and profile_changed:
+            badge_bottom = self.rating_badge_pos[1] + self.rating_badge_size[1]
+            restore_boxes.append((0, 0, template_key[0], max(self.profile_height, badge_bottom)))
+        
+        changed_titles = []
+        for (x, y, _, section_rating), (_, _, _, old_rating) in zip(titles, previous['titles']):
+            if section_rating != old_rating:
+                old_box = measure.textbbox(self.section_rating_pos(x, y), f"{old_rating:.2f}", font=self.title_font)
+                new_box = measure.textbbox(self.section_rating_pos(x, y), f"{section_rating:.2f}", font=self.title_font)
+                restore_boxes.append((min(old_box[0], new_box[0]), min(old_box[1], new_box[1]),
+                                      max(old_box[2], new_box[2]), max(old_box[3], new_box[3])))
+                changed_titles.append((x, y, section_rating))
+        
+        for left, top, right, bottom in restore_boxes:
+            for x, y, _, (tile_width, tile_height), _ in cells:
+                if left < x + tile_width and x < right and top < y + tile_height + 1 and y < bottom:
+                    return None
+        
+        redraw = [i for i, cell in enumerate(cells) if self.cell_fingerprint(cell) != previous['cell_fingerprints'][i]]
+        
+        self.base_image = previous['image'].copy()
+        draw = ImageDraw.Draw(self.base_image)
+        for box in restore_boxes:
+            self.base_image.paste(template.crop(box), box[:2])
+        
+        if player_data and profile_changed:
+            self.draw_profile_details(draw, player_data)
+        for x, y, section_rating in changed_titles:
+            self.draw_section_rating(draw, x, y, section_rating)
+        
+        if redraw:
+            self._draw_cells(draw, cells, redraw)
         return self.base_image
 
+    def _verify_incremental(self, image, template_key, titles, cells, player_data):
+        """测试模式：与完整渲染的结果逐像素比较"""
+        incremental_image = self.base_image
+        full_image = self._render_full(template_key, titles, cells, player_data)
+        self.base_image = incremental_image
+        diff_box = ImageChops.difference(image, full_image).getbbox()
+        if diff_box is not None:
+            raise AssertionError(f"Incremental render differs from full render in {diff_box}")
+
+# 进程池中每个子进程各自持有的生成器
+_tile_worker_generator = None
+
+def _init_tile_worker(options):
+    """单元格渲染子进程的初始化函数，options见B55GramGenerator.worker_options"""
+    global _tile_worker_generator
+    FontRegistry.configure(options['font_search_paths'])
+    jacket_store = JacketPack(options['jacket_pack'], import_dir=None) if options['jacket_pack'] else None
+    # 子进程不下载资源，缺失的封面由主进程预取
+    _tile_worker_generator = B55GramGenerator(scale=options['scale'], layout=options['layout'],
+                                              assets=AssetBundle(options['assets_root']), jacket_store=jacket_store,
+                                              tile_cache=JacketTileCache(options['tile_cache_dir']), offline=True)
+
+# 子进程中映射的背景图集文件：路径 -> mmap
+_tile_worker_atlases = {}
+
+def _load_atlas_background(atlas_ref):
+    """从共享背景图集中取出单元格背景（RGBX），直接引用映射的内存，不复制"""
+    path, offset, size = atlas_ref
+    length = size[0] * size[1] * 4
+    mapped = _tile_worker_atlases.get(path)
+    if mapped is None or len(mapped) < offset + length:
+        # 首次使用或图集在上次映射后又追加了背景，重新映射；旧的映射在不再被引用后释放
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _tile_worker_atlases.clear()
+        _tile_worker_atlases[path] = mapped
+    return Image.frombuffer('RGBX', size, memoryview(mapped)[offset:offset + length], 'raw', 'RGBX', 0, 1)
+
+def _render_tile_in_worker(song_data, tile_size, atlas_ref=None):
+    """在子进程中渲染单元格，以原始字节返回，减少序列化开销"""
+    if atlas_ref:
+        background = _load_atlas_background(atlas_ref)
+    else:
+        # 背景在子进程中生成，需要看到主进程预取后追加的封面
+        background = None
+        _tile_worker_generator.jacket_store.refresh()
+    tile = _tile_worker_generator.render_cell_tile(song_data, tile_size, background)
+    return tile.size, tile.tobytes()
+
 def main():
+    if sys.argv[1:2] == ['cache']:
+        cache_main(sys.argv[2:])
+        return
+    import argparse
+    parser = argparse.ArgumentParser(description='根据b50.json生成B55图片')
+    parser.add_argument('--output', default='b55_gram.png', help='输出文件，格式按扩展名判断(.png/.webp/.jpg)')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), help='输出格式，覆盖扩展名判断')
+    parser.add_argument('--quality', type=int, help='WebP/JPEG质量(1-100)')
+    parser.add_argument('--compress-level', type=int, help='PNG压缩级别(0-9)，越小越快')
+    parser.add_argument('--lossless', action='store_true', help='WebP无损编码')
+    parser.add_argument('--quantize', type=int, help='量化为指定颜色数的调色板图片')
+    parser.add_argument('--scale', type=float, default=1.0, help='渲染缩放比例，如0.5生成低分辨率预览')
+    parser.add_argument('--offline', action='store_true', help='不下载缺失的资源和封面')
+    parser.add_argument('--strip-height', type=int, help='按指定高度的条带渲染并流式写出，内存占用与图像高度无关；'
+                                                       '输出为.png时写出一张PNG，否则输出为条带目录和manifest.json')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='b55', help='图像布局，records为所有游玩记录')
+    args = parser.parse_args()
+    
     # 确保assets目录存在
     if not os.path.exists('assets'):
         os.makedirs('assets')
@@ -854,7 +2950,9 @@ def main():
             # 画一个圆形
             draw.ellipse((10, 10, 90, 90), fill=(150, 150, 150))
             # 保存
-            img.save(default_avatar_path)
+            buffer = io.BytesIO()
+            img.save(buffer, format='WEBP')
+            write_file_atomic(default_avatar_path, buffer.getvalue())
             print(f"Created default avatar: {default_avatar_path}")
         except Exception as e:
             print(f"Error creating default avatar: {e}")
@@ -907,12 +3005,22 @@ def main():
         }
     
     # 生成图像
-    generator = B55GramGenerator()
-    image = generator.generate(json_data, player_data)
-    
-    # 保存图像
-    image.save('b55_gram.png')
-    print("B55-gram has been generated as 'b55_gram.png'")
+    generator = B55GramGenerator(scale=args.scale, offline=args.offline, layout=args.layout)
+    if not args.offline and generator.assets.needs_fetch(generator.jacket_store):
+        generator.fetch_assets()
+    if args.strip_height:
+        result = generator.render_strips(json_data, player_data, args.output, args.strip_height, args.format,
+                                         args.compress_level, quality=args.quality, lossless=args.lossless)
+        print(f"B55-gram has been generated as '{args.output}' "
+              f"({result['format']}, {result['width']}x{result['height']}, {result['strips']} strips, "
+              f"{result['size'] / 1024:.0f} KB, {result['elapsed']:.2f}s)")
+        return
+    # 生成并保存图像，输入和参数没有变化时直接使用上次的结果
+    result = generator.render_cached(json_data, player_data, args.output, fmt=args.format, quality=args.quality,
+                                     compress_level=args.compress_level, lossless=args.lossless, quantize=args.quantize)
+    source = "from render cache" if result['cached'] else f"encoded in {result['encode_time']:.2f}s"
+    print(f"B55-gram has been generated as '{args.output}' "
+          f"({result['format']}, {result['size'] / 1024:.0f} KB, {source})")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
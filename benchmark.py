@@ -0,0 +1,347 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import PIL
+from PIL import ImageChops
+
+from b55_gram import (B55GramGenerator, CellTileCache, JacketImageCache, JacketPack, JacketTileCache, RenderCache,
+                      calculate_constant, encode_image)
+from synthetic import song_lists, synthetic_jacket, synthetic_payload
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def load_b50(json_file):
+    """读取b50.json，返回(rating数据, 玩家资料)"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('rating', {}), data.get('profile')
+
+def images_equal(a, b):
+    """逐像素比较两张图片"""
+    return a.size == b.size and ImageChops.difference(a.convert('RGB'), b.convert('RGB')).getbbox() is None
+
+def bench_render_workers(json_data, player_data, worker_counts, pool='process', repeat=3):
+    """
+    测量不同并发数下generate()的耗时，返回加速比曲线。
+    每种配置使用全新的生成器和临时目录中的空缓存：第一次运行为冷缓存耗时（包括创建进程池、生成单元格背景），
+    之后取多次运行的最短耗时为热缓存耗时。单元格图块缓存容量设为0，每次都实际渲染所有单元格
+    """
+    results = []
+    reference = None
+    serial_cold = serial_warm = None
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory(prefix='b55-bench-') as cache_dir:
+            generator = B55GramGenerator(tile_cache=JacketTileCache(cache_dir=os.path.join(cache_dir, 'tiles')),
+                                         cell_cache=CellTileCache(max_memory_bytes=0), jacket_cache=JacketImageCache(),
+                                         render_workers=workers, render_pool=pool)
+            try:
+                start_time = time.perf_counter()
+                cold_image = generator.generate(json_data, player_data)
+                cold = time.perf_counter() - start_time
+                timings = []
+                for _ in range(repeat):
+                    start_time = time.perf_counter()
+                    image = generator.generate(json_data, player_data)
+                    timings.append(time.perf_counter() - start_time)
+            finally:
+                generator.close()
+
+        warm = min(timings)
+        if reference is None:
+            reference = image.copy()
+            serial_cold, serial_warm = cold, warm
+        results.append({
+            'workers': workers,
+            'pool': pool,
+            'cold_seconds': cold,
+            'seconds': warm,
+            'cold_speedup': serial_cold / cold if cold > 0 else 0,
+            'speedup': serial_warm / warm if warm > 0 else 0,
+            'identical': images_equal(reference, cold_image) and images_equal(reference, image),
+        })
+    return results
+
+def reset_peak_rss():
+    """重置进程的内存峰值统计（仅Linux支持），之后的峰值只反映当前阶段"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def read_proc_status(field):
+    """读取/proc/self/status中的内存字段（字节），不支持时返回None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss():
+    """进程的内存峰值（字节）：Linux上为重置后的峰值，其他平台为进程启动以来的峰值"""
+    peak = read_proc_status('VmHWM')
+    if peak is not None:
+        return peak
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def measure(func, repeat=1, allocations=False):
+    """
+    多次运行func，返回最短一次的墙钟时间和对应的CPU时间，以及所有运行中的内存峰值。
+    内存峰值包含之前各阶段留下的内存，rss_growth为峰值比阶段开始时多出的部分（仅Linux）。
+    allocations为True时再用tracemalloc单独运行一次，统计Python对象分配的峰值（不影响计时）
+    """
+    best = None
+    peak = None
+    growth = None
+    for _ in range(repeat):
+        reset_peak_rss()
+        rss_start = read_proc_status('VmRSS')
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        func()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        rss = peak_rss()
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+        if rss is not None:
+            peak = rss if peak is None else max(peak, rss)
+            if rss_start is not None:
+                growth = max(growth or 0, rss - rss_start)
+    result = {'wall': best[0], 'cpu': best[1], 'peak_rss': peak, 'rss_growth': growth, 'alloc_peak': None}
+    if allocations:
+        tracemalloc.start()
+        try:
+            func()
+            result['alloc_peak'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+class StageBenchmark:
+    """
+    用合成数据测量各阶段的耗时和内存：rating计算、布局、冷/热缓存渲染、条带渲染、PNG编码和Excel导出。
+    55首使用b55布局，更多的成绩使用全部记录(records)布局。
+    封面和缓存都放在临时目录中，只使用当前目录assets中的字体和图标
+    """
+    STAGES = ['rating', 'layout', 'render_cold', 'render_warm', 'strips', 'encode_png', 'excel']
+
+    def __init__(self, jackets=64, max_full_pixels=100_000_000, repeat=1, allocations=False):
+        self.repeat = repeat
+        self.allocations = allocations
+        self.max_full_pixels = max_full_pixels
+        self.work_dir = tempfile.mkdtemp(prefix='b55-bench-')
+        self.jacket_store = JacketPack(os.path.join(self.work_dir, 'covers.pack'), import_dir=os.path.join(self.work_dir, 'cover'))
+        # 少量不同的封面数据按music_id循环使用，避免生成上千张图片
+        self.jacket_data = [synthetic_jacket(seed, fmt='WEBP') for seed in range(jackets)]
+        self.run_index = 0
+
+    def payload(self, size):
+        """生成size条成绩的数据，返回(rating数据, 玩家资料, 布局)"""
+        if size <= 55:
+            best = min(size, 30)
+            new = min(size - best, 15)
+            rating_data, player_data = synthetic_payload(size, best=best, new=new, recent=size - best - new)
+            layout = 'b55'
+        else:
+            rating_data, player_data = synthetic_payload(size, best=size, new=0, recent=0)
+            layout = 'records'
+        for i, song in enumerate(song_lists(rating_data)):
+            music_id = song['music']['music_id']
+            if music_id not in self.jacket_store:
+                self.jacket_store.append(music_id, self.jacket_data[i % len(self.jacket_data)])
+        return rating_data, player_data, layout
+
+    def generator(self, layout):
+        """使用全新缓存的生成器"""
+        self.run_index += 1
+        cache_dir = os.path.join(self.work_dir, f"cache{self.run_index}")
+        return B55GramGenerator(tile_cache=JacketTileCache(cache_dir=os.path.join(cache_dir, 'tiles')),
+                                cell_cache=CellTileCache(), jacket_store=self.jacket_store, jacket_cache=JacketImageCache(),
+                                render_cache=RenderCache(os.path.join(cache_dir, 'renders')), offline=True, layout=layout)
+
+    def run(self, size):
+        """测量一个数据规模下的所有阶段，返回结果列表"""
+        rating_data, player_data, layout = self.payload(size)
+        merged_data = {'rating': rating_data, 'profile': player_data}
+        results = []
+
+        def record(stage, func, skipped=None):
+            if skipped:
+                results.append({'size': size, 'stage': stage, 'skipped': skipped})
+                print(f"{size:>6} {stage:<12} skipped: {skipped}")
+                return
+            result = measure(func, self.repeat, self.allocations)
+            result.update({'size': size, 'stage': stage, 'skipped': None})
+            results.append(result)
+            print(format_stage(result))
+
+        songs = song_lists(rating_data)
+        probe = self.generator(layout)
+        record('rating', lambda: ([calculate_constant(song['score'], song['rating']) for song in songs],
+                                  probe.section_songs(rating_data)))
+
+        def layout_stage():
+            B55GramGenerator._plan_cache.items.clear()
+            probe.place_cells(rating_data, probe.section_songs(rating_data), player_data)
+        record('layout', layout_stage)
+        (width, height, _, _), _, _ = probe.place_cells(rating_data, probe.section_songs(rating_data), player_data)
+
+        too_large = f"{width}x{height} exceeds --max-full-pixels" if width * height > self.max_full_pixels else None
+        warm = self.generator(layout)
+        image = [None]
+        def render_cold():
+            generator = self.generator(layout)
+            try:
+                image[0] = generator.generate(rating_data, player_data)
+            finally:
+                generator.close()
+        record('render_cold', render_cold, too_large)
+        if not too_large:
+            warm.generate(rating_data, player_data)
+        record('render_warm', lambda: warm.generate(rating_data, player_data), too_large)
+        warm.close()
+
+        strip_path = os.path.join(self.work_dir, 'strips.png')
+        def strips():
+            generator = self.generator(layout)
+            try:
+                generator.render_strips(rating_data, player_data, strip_path)
+            finally:
+                generator.close()
+        record('strips', strips)
+        record('encode_png', lambda: encode_image(image[0], fmt='png'), too_large)
+        image[0] = None
+
+        try:
+            from get_rating import B50Converter
+        except ImportError as e:
+            record('excel', None, f"get_rating unavailable ({e})")
+        else:
+            # get_rating导入时把日志级别设为DEBUG，测试期间只保留警告
+            logging.getLogger().setLevel(logging.WARNING)
+            excel_path = os.path.join(self.work_dir, 'bench.xlsx')
+            record('excel', lambda: B50Converter().write_excel(merged_data, excel_path))
+        probe.close()
+        return results
+
+    def close(self):
+        self.jacket_store.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def format_bytes(value):
+    return '-' if value is None else f"{value / 1024 / 1024:.1f}MB"
+
+def format_stage(result):
+    return (f"{result['size']:>6} {result['stage']:<12} {result['wall']:>9.3f}s {result['cpu']:>9.3f}s "
+            f"{format_bytes(result['peak_rss']):>10} {format_bytes(result['rss_growth']):>10} {format_bytes(result['alloc_peak']):>10}")
+
+def bench_stages(sizes, jackets=64, max_full_pixels=100_000_000, repeat=1, allocations=False):
+    """测量各数据规模下各阶段的性能，返回{'environment', 'results'}"""
+    benchmark = StageBenchmark(jackets, max_full_pixels, repeat, allocations)
+    print(f"{'成绩数':>6} {'阶段':<10} {'墙钟时间':>8} {'CPU时间':>9} {'内存峰值':>7} {'内存增长':>7} {'Python分配':>8}")
+    results = []
+    try:
+        for size in sizes:
+            results += benchmark.run(size)
+    finally:
+        benchmark.close()
+    environment = {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return {'environment': environment, 'results': results}
+
+def compare_with_baseline(report, baseline, tolerance=0.1):
+    """
+    与基准结果比较墙钟时间和内存峰值，超过基准(1 + tolerance)倍视为退化。
+    返回退化的项目列表
+    """
+    baseline_results = {(r['size'], r['stage']): r for r in baseline.get('results', []) if not r.get('skipped')}
+    regressions = []
+    print(f"\n{'成绩数':>6} {'阶段':<10} {'基准时间':>8} {'当前时间':>8} {'比值':>6} {'内存比值':>6}")
+    for result in report['results']:
+        base = baseline_results.get((result['size'], result['stage']))
+        if base is None or result.get('skipped'):
+            continue
+        ratio = result['wall'] / base['wall'] if base['wall'] > 0 else 0
+        # 内存按阶段内的增长比较，不受之前阶段留下的内存影响
+        rss_ratio = (result['rss_growth'] / base['rss_growth']
+                     if result.get('rss_growth') and base.get('rss_growth') and base['rss_growth'] > 16 * 1024 * 1024 else None)
+        # 只有几毫秒的阶段计时波动较大，差值不到5毫秒时不算退化
+        slower = ratio > 1 + tolerance and result['wall'] - base['wall'] > 0.005
+        regressed = slower or (rss_ratio is not None and rss_ratio > 1 + tolerance)
+        if regressed:
+            regressions.append((result['size'], result['stage']))
+        rss_text = '-' if rss_ratio is None else f"{rss_ratio:.2f}"
+        print(f"{result['size']:>6} {result['stage']:<12} {base['wall']:>9.3f}s {result['wall']:>9.3f}s {ratio:>7.2f} "
+              f"{rss_text:>9}{'  退化' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='B55图片渲染性能测试')
+    parser.add_argument('--input', default='b50.json', help='输入的b50.json文件')
+    parser.add_argument('--workers', default=f"1,2,4,{os.cpu_count() or 1}", help='逗号分隔的并发数列表，第一项作为基准')
+    parser.add_argument('--pool', choices=['thread', 'process'], default='process', help='单元格渲染池类型')
+    parser.add_argument('--repeat', type=int, default=3, help='每种配置的重复次数')
+    parser.add_argument('--output', help='将结果保存为JSON文件')
+    parser.add_argument('--sizes', help='逗号分隔的成绩数列表（如55,500,5000），使用合成数据测量各阶段，代替并发数测试')
+    parser.add_argument('--jackets', type=int, default=64, help='合成数据中不同封面的数量')
+    parser.add_argument('--max-full-pixels', type=int, default=100_000_000, help='整图渲染的像素上限，超过时只测量条带渲染')
+    parser.add_argument('--allocations', action='store_true', help='额外运行一次，用tracemalloc统计Python对象分配峰值')
+    parser.add_argument('--baseline', help='与之前保存的阶段测试结果比较')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='与基准比较时允许的退化比例')
+    args = parser.parse_args()
+
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        report = bench_stages(sizes, args.jackets, args.max_full_pixels, args.repeat, args.allocations)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"结果已保存到 {args.output}")
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_with_baseline(report, baseline, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)}项超过基准的{1 + args.tolerance:.0%}")
+                sys.exit(1)
+        return
+
+    json_data, player_data = load_b50(args.input)
+    worker_counts = [int(w) for w in args.workers.split(',')]
+    results = bench_render_workers(json_data, player_data, worker_counts, args.pool, args.repeat)
+
+    print(f"{'并发数':>6} {'冷缓存(秒)':>10} {'加速比':>8} {'热缓存(秒)':>10} {'加速比':>8}  像素一致")
+    for result in results:
+        print(f"{result['workers']:>6} {result['cold_seconds']:>10.3f} {result['cold_speedup']:>8.2f} "
+              f"{result['seconds']:>10.3f} {result['speedup']:>8.2f}  {result['identical']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+if __name__ == "__main__":
+    main()
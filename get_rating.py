@@ -13,6 +13,9 @@ from openpyxl.styles import Alignment
 from openpyxl.cell.cell import MergedCell
 import cloudscraper
 import traceback
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import Workbook, load_workbook
 
 # 设置日志
 logging.basicConfig(
@@ -801,6 +804,9 @@ def get_player_profile(auth_token, session=None):
         return None
 
 class B50Converter:
+    TREND_SHEET = 'Rating趋势'
+    TREND_HEADERS = ['日期', '总Rating', '最佳Rating', '新曲Rating', '最近Rating', '快照哈希']
+
     @staticmethod
     def calculate_constant(score, rating):
         """根据分数和rating计算定数"""
@@ -863,27 +869,10 @@ class B50Converter:
             else:
                 cell.number_format = '0.0'   # 定数显示一位小数
 
-    def convert_to_excel(self, json_file, excel_file):
-        """将JSON格式的B50数据转换为Excel格式"""
-        logger.info(f"开始将 {json_file} 转换为Excel格式...")
-        
-        # 读取JSON文件
-        with open(json_file, 'r', encoding='utf-8') as f:
-            merged_data = json.load(f)
-        
-        # 获取评分数据
-        data = merged_data.get("rating", {})
-        profile = merged_data.get("profile", {}).get("data", {})
-
-        # 获取文件中的总rating值
-        total_rating = data['data']['rating'] / 100
-        best_rating = data['data']['best_rating'] / 100
-        new_rating = data['data']['best_new_rating'] / 100
-        recent_rating = data['data']['hot_rating'] / 100
-
-        # 处理三个部分的数据
-        best_data = []
-        for idx, song in enumerate(data['data']['best_rating_list'], 1):
+    def _build_section_data(self, song_list):
+        """整理单个区段的歌曲数据"""
+        section_data = []
+        for idx, song in enumerate(song_list, 1):
             if song['rating'] > 0:  # 只处理有效的rating
                 name = song['music']['name']
                 diff_text = self.get_difficulty_text(song['difficulty'])
@@ -891,25 +880,7 @@ class B50Converter:
                 rating = song['rating'] / 100
                 constant = self.calculate_constant(score, song['rating'])
                 
-                best_data.append({
-                    '次序': idx,
-                    '曲名': name,
-                    '难度': diff_text,
-                    '定数': constant,
-                    '分数': score,
-                    '单曲Rating': rating
-                })
-
-        new_data = []
-        for idx, song in enumerate(data['data']['best_new_rating_list'], 1):
-            if song['rating'] > 0:
-                name = song['music']['name']
-                diff_text = self.get_difficulty_text(song['difficulty'])
-                score = song['score']
-                rating = song['rating'] / 100
-                constant = self.calculate_constant(score, song['rating'])
-                
-                new_data.append({
+                section_data.append({
                     '次序': idx,
                     '曲名': name,
                     '难度': diff_text,
@@ -917,168 +888,298 @@ class B50Converter:
                     '分数': score,
                     '单曲Rating': rating
                 })
+        return section_data
 
-        recent_data = []
-        for idx, song in enumerate(data['data']['hot_rating_list'], 1):
-            if song['rating'] > 0:
-                name = song['music']['name']
-                diff_text = self.get_difficulty_text(song['difficulty'])
-                score = song['score']
-                rating = song['rating'] / 100
-                constant = self.calculate_constant(score, song['rating'])
-                
-                recent_data.append({
-                    '次序': idx,
-                    '曲名': name,
-                    '难度': diff_text,
-                    '定数': constant,
-                    '分数': score,
-                    '单曲Rating': rating
-                })
-
-        # 创建Excel文件
-        with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-            
-            # 写入B50详情
-            writer.sheets['B50详情'] = writer.book.create_sheet('B50详情', 0)
-            
-            # 写入最佳曲目数据
-            row_offset = 1  # 从第2行开始（第1行为标题）
-            writer.sheets['B50详情'].merge_cells(f'A{row_offset}:F{row_offset}')
-            writer.sheets['B50详情'].cell(row=row_offset, column=1, value="RATING对象曲（最佳）")
-            writer.sheets['B50详情'].cell(row=row_offset, column=1).alignment = Alignment(horizontal='center')
-            
-            # 写入列标题
-            headers = ['次序', '曲名', '难度', '定数', '分数', '单曲Rating']
-            for col_idx, header in enumerate(headers, 1):
-                writer.sheets['B50详情'].cell(row=row_offset+1, column=col_idx, value=header)
-            
-            # 写入数据
-            for idx, row in enumerate(best_data):
-                row_idx = row_offset + 2 + idx
-                for col_idx, (key, value) in enumerate(row.items(), 1):
-                    cell = writer.sheets['B50详情'].cell(row=row_idx, column=col_idx)
-                    if key in ['定数', '单曲Rating']:
-                        self.set_number_format(cell, value, is_rating=(key=='单曲Rating'))
-                    else:
-                        cell.value = value
-            
-            # 写入统计信息
-            summary_row = row_offset + 2 + len(best_data)
-            writer.sheets['B50详情'].cell(row=summary_row, column=1, value=f"歌曲数: {len(best_data)}首")
-            cell = writer.sheets['B50详情'].cell(row=summary_row, column=6)
-            self.set_number_format(cell, best_rating, is_rating=True)
-            
-            # 写入新曲目数据（从最佳下面空一行开始）
-            row_offset = summary_row + 1
-            writer.sheets['B50详情'].merge_cells(f'A{row_offset}:F{row_offset}')
-            writer.sheets['B50详情'].cell(row=row_offset, column=1, value="RATING对象曲（新曲）")
-            writer.sheets['B50详情'].cell(row=row_offset, column=1).alignment = Alignment(horizontal='center')
+    def _write_b50_sheet(self, sheet, data):
+        """将评分数据写入B50详情工作表"""
+        # 获取文件中的总rating值
+        total_rating = data['data']['rating'] / 100
+        sections = [
+            ("RATING对象曲（最佳）", self._build_section_data(data['data']['best_rating_list']), data['data']['best_rating'] / 100),
+            ("RATING对象曲（新曲）", self._build_section_data(data['data']['best_new_rating_list']), data['data']['best_new_rating'] / 100),
+            ("RATING对象曲（最近）", self._build_section_data(data['data']['hot_rating_list']), data['data']['hot_rating'] / 100),
+        ]
+        headers = ['次序', '曲名', '难度', '定数', '分数', '单曲Rating']
+        
+        row_offset = 1  # 从第2行开始（第1行为标题）
+        for title, section_data, section_rating in sections:
+            sheet.merge_cells(f'A{row_offset}:F{row_offset}')
+            sheet.cell(row=row_offset, column=1, value=title)
+            sheet.cell(row=row_offset, column=1).alignment = Alignment(horizontal='center')
             
             # 写入列标题
             for col_idx, header in enumerate(headers, 1):
-                writer.sheets['B50详情'].cell(row=row_offset+1, column=col_idx, value=header)
+                sheet.cell(row=row_offset+1, column=col_idx, value=header)
             
             # 写入数据
-            for idx, row in enumerate(new_data):
+            for idx, row in enumerate(section_data):
                 row_idx = row_offset + 2 + idx
                 for col_idx, (key, value) in enumerate(row.items(), 1):
-                    cell = writer.sheets['B50详情'].cell(row=row_idx, column=col_idx)
+                    cell = sheet.cell(row=row_idx, column=col_idx)
                     if key in ['定数', '单曲Rating']:
                         self.set_number_format(cell, value, is_rating=(key=='单曲Rating'))
                     else:
                         cell.value = value
             
             # 写入统计信息
-            summary_row = row_offset + 2 + len(new_data)
-            writer.sheets['B50详情'].cell(row=summary_row, column=1, value=f"歌曲数: {len(new_data)}首")
-            cell = writer.sheets['B50详情'].cell(row=summary_row, column=6)
-            self.set_number_format(cell, new_rating, is_rating=True)
+            summary_row = row_offset + 2 + len(section_data)
+            sheet.cell(row=summary_row, column=1, value=f"歌曲数: {len(section_data)}首")
+            cell = sheet.cell(row=summary_row, column=6)
+            self.set_number_format(cell, section_rating, is_rating=True)
             
-            # 写入最近曲目数据（从新曲下面空一行开始）
+            # 下一部分从统计信息下面开始
             row_offset = summary_row + 1
-            writer.sheets['B50详情'].merge_cells(f'A{row_offset}:F{row_offset}')
-            writer.sheets['B50详情'].cell(row=row_offset, column=1, value="RATING对象曲（最近）")
-            writer.sheets['B50详情'].cell(row=row_offset, column=1).alignment = Alignment(horizontal='center')
-            
-            # 写入列标题
-            for col_idx, header in enumerate(headers, 1):
-                writer.sheets['B50详情'].cell(row=row_offset+1, column=col_idx, value=header)
-            
-            # 写入数据
-            for idx, row in enumerate(recent_data):
-                row_idx = row_offset + 2 + idx
-                for col_idx, (key, value) in enumerate(row.items(), 1):
-                    cell = writer.sheets['B50详情'].cell(row=row_idx, column=col_idx)
-                    if key in ['定数', '单曲Rating']:
-                        self.set_number_format(cell, value, is_rating=(key=='单曲Rating'))
-                    else:
-                        cell.value = value
+        
+        # 写入总Rating
+        sheet.cell(row=row_offset, column=1, value="总Rating")
+        cell = sheet.cell(row=row_offset, column=6)
+        self.set_number_format(cell, total_rating, is_rating=True)
+
+        # 自动调整列宽
+        for column in range(1, 7):  # 遍历6列
+            max_length = 0
+            for row in sheet.rows:
+                cell = row[column-1]
+                if cell.value and not isinstance(cell, MergedCell):
+                    max_length = max(max_length, len(str(cell.value)))
+            adjusted_width = max_length + 2
+            sheet.column_dimensions[get_column_letter(column)].width = adjusted_width
+        
+        return total_rating
+
+    def _write_profile_sheet(self, info_sheet, profile):
+        """将玩家资料写入玩家信息工作表"""
+        info_sheet.cell(row=1, column=1, value="玩家信息")
+        info_sheet.merge_cells('A1:B1')
+        info_sheet.cell(row=1, column=1).alignment = Alignment(horizontal='center')
+        
+        # 写入玩家基本信息
+        info_data = [
+            ("玩家名称", profile.get('user_name', 'Unknown')),
+            ("等级", profile.get('level', 'Unknown')),
+            ("游玩次数", profile.get('play_count', 'Unknown')),
+            ("最高Rating", profile.get('highest_rating', 'Unknown')/100 if isinstance(profile.get('highest_rating'), (int, float)) else 'Unknown'),
+            ("当前Rating", profile.get('player_rating', 'Unknown')/100 if isinstance(profile.get('player_rating'), (int, float)) else 'Unknown'),
+            ("总点数", profile.get('total_point', 'Unknown')),
+            ("好友码", profile.get('friend_code', 'Unknown')),
+            ("奖章数", profile.get('medal_count', 'Unknown')),
+            ("战斗点数", profile.get('battle_point', 'Unknown')),
+        ]
+        
+        for idx, (key, value) in enumerate(info_data, 2):
+            info_sheet.cell(row=idx, column=1, value=key)
+            cell = info_sheet.cell(row=idx, column=2)
+            if isinstance(value, float):
+                self.set_number_format(cell, value, is_rating=True)
+            else:
+                cell.value = value
+        
+        # 调整列宽
+        for column in range(1, 3):
+            max_length = 0
+            for row in range(1, len(info_data) + 2):
+                cell = info_sheet.cell(row=row, column=column)
+                if cell.value:
+                    max_length = max(max_length, len(str(cell.value)))
+            adjusted_width = max_length + 2
+            info_sheet.column_dimensions[get_column_letter(column)].width = adjusted_width
+
+    def convert_to_excel(self, json_file, excel_file):
+        """将JSON格式的B50数据转换为Excel格式"""
+        logger.info(f"开始将 {json_file} 转换为Excel格式...")
+        
+        # 读取JSON文件
+        with open(json_file, 'r', encoding='utf-8') as f:
+            merged_data = json.load(f)
+        
+        self.write_excel(merged_data, excel_file)
+
+    def write_excel(self, merged_data, excel_file):
+        """将已加载的B50数据写入Excel文件"""
+        # 获取评分数据
+        data = merged_data.get("rating", {})
+        profile = (merged_data.get("profile") or {}).get("data", {})
+
+        # 创建Excel文件
+        with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
             
-            # 写入统计信息
-            summary_row = row_offset + 2 + len(recent_data)
-            writer.sheets['B50详情'].cell(row=summary_row, column=1, value=f"歌曲数: {len(recent_data)}首")
-            cell = writer.sheets['B50详情'].cell(row=summary_row, column=6)
-            self.set_number_format(cell, recent_rating, is_rating=True)
+            # 写入B50详情
+            writer.sheets['B50详情'] = writer.book.create_sheet('B50详情', 0)
+            total_rating = self._write_b50_sheet(writer.sheets['B50详情'], data)
             
-            # 写入总Rating（从最近下面空一行开始）
-            row_offset = summary_row + 1
-            writer.sheets['B50详情'].cell(row=row_offset, column=1, value="总Rating")
-            cell = writer.sheets['B50详情'].cell(row=row_offset, column=6)
-            self.set_number_format(cell, total_rating, is_rating=True)
-
-            # 自动调整列宽
-            for column in range(1, 7):  # 遍历6列
-                max_length = 0
-                for row in writer.sheets['B50详情'].rows:
-                    cell = row[column-1]
-                    if cell.value and not isinstance(cell, MergedCell):
-                        max_length = max(max_length, len(str(cell.value)))
-                adjusted_width = max_length + 2
-                writer.sheets['B50详情'].column_dimensions[get_column_letter(column)].width = adjusted_width
             # 写入玩家信息
             writer.sheets['玩家信息'] = writer.book.create_sheet('玩家信息', 1)
             if profile:
-                info_sheet = writer.sheets['玩家信息']
-                info_sheet.cell(row=1, column=1, value="玩家信息")
-                info_sheet.merge_cells('A1:B1')
-                info_sheet.cell(row=1, column=1).alignment = Alignment(horizontal='center')
-                
-                # 写入玩家基本信息
-                info_data = [
-                    ("玩家名称", profile.get('user_name', 'Unknown')),
-                    ("等级", profile.get('level', 'Unknown')),
-                    ("游玩次数", profile.get('play_count', 'Unknown')),
-                    ("最高Rating", profile.get('highest_rating', 'Unknown')/100 if isinstance(profile.get('highest_rating'), (int, float)) else 'Unknown'),
-                    ("当前Rating", profile.get('player_rating', 'Unknown')/100 if isinstance(profile.get('player_rating'), (int, float)) else 'Unknown'),
-                    ("总点数", profile.get('total_point', 'Unknown')),
-                    ("好友码", profile.get('friend_code', 'Unknown')),
-                    ("奖章数", profile.get('medal_count', 'Unknown')),
-                    ("战斗点数", profile.get('battle_point', 'Unknown')),
-                ]
-                
-                for idx, (key, value) in enumerate(info_data, 2):
-                    info_sheet.cell(row=idx, column=1, value=key)
-                    cell = info_sheet.cell(row=idx, column=2)
-                    if isinstance(value, float):
-                        self.set_number_format(cell, value, is_rating=True)
-                    else:
-                        cell.value = value
-                
-                # 调整列宽
-                for column in range(1, 3):
-                    max_length = 0
-                    for row in range(1, len(info_data) + 2):
-                        cell = info_sheet.cell(row=row, column=column)
-                        if cell.value:
-                            max_length = max(max_length, len(str(cell.value)))
-                    adjusted_width = max_length + 2
-                    info_sheet.column_dimensions[get_column_letter(column)].width = adjusted_width
+                self._write_profile_sheet(writer.sheets['玩家信息'], profile)
 
 
         logger.info(f"转换完成！文件已保存为 {excel_file}")
         logger.info(f"玩家总Rating: {total_rating:.2f}")
 
+    @staticmethod
+    def snapshot_hash(rating_data):
+        """计算评分快照的内容哈希，用于判断数据是否有变化"""
+        normalized = json.dumps(rating_data.get('data', {}), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _read_last_history_hash(self, history_file):
+        """以只读模式读取历史工作簿中最后一次快照的哈希值"""
+        workbook = load_workbook(history_file, read_only=True)
+        try:
+            if self.TREND_SHEET not in workbook.sheetnames:
+                return None
+            last_hash = None
+            for row in workbook[self.TREND_SHEET].iter_rows(min_row=2, values_only=True):
+                if row and len(row) >= len(self.TREND_HEADERS) and row[-1]:
+                    last_hash = row[-1]
+            return last_hash
+        finally:
+            workbook.close()
+
+    def append_to_history(self, json_file, history_file, snapshot_date=None):
+        """
+        将新的快照追加到历史工作簿中（每天一个工作表），并增量更新趋势表。
+        如果新快照与上一次的内容相同，则不写入文件。
+        返回新建的工作表名称，未写入时返回None
+        """
+        logger.info(f"开始将 {json_file} 追加到历史工作簿 {history_file}...")
+        
+        with open(json_file, 'r', encoding='utf-8') as f:
+            merged_data = json.load(f)
+        
+        return self.append_data_to_history(merged_data, history_file, snapshot_date)
+
+    def append_data_to_history(self, merged_data, history_file, snapshot_date=None):
+        """将已加载的快照追加到历史工作簿，参见append_to_history"""
+        data = merged_data.get("rating", {})
+        
+        content_hash = self.snapshot_hash(data)
+        
+        # 先用只读模式检查哈希，数据未变化时不必加载整个工作簿
+        if os.path.exists(history_file):
+            if self._read_last_history_hash(history_file) == content_hash:
+                logger.info("快照内容与上一次相同，跳过写入")
+                return None
+            workbook = load_workbook(history_file)
+        else:
+            workbook = Workbook()
+            workbook.remove(workbook.active)
+        
+        # 工作表以日期命名，同一天多次追加时添加序号
+        if snapshot_date is None:
+            snapshot_date = time.strftime('%Y-%m-%d')
+        sheet_name = snapshot_date
+        suffix = 2
+        while sheet_name in workbook.sheetnames:
+            sheet_name = f"{snapshot_date} ({suffix})"
+            suffix += 1
+        
+        # 只创建新的快照工作表，已有的工作表保持不变
+        total_rating = self._write_b50_sheet(workbook.create_sheet(sheet_name), data)
+        
+        # 增量更新趋势表
+        if self.TREND_SHEET in workbook.sheetnames:
+            trend_sheet = workbook[self.TREND_SHEET]
+        else:
+            trend_sheet = workbook.create_sheet(self.TREND_SHEET, 0)
+            trend_sheet.append(self.TREND_HEADERS)
+            # 哈希列仅供程序使用，默认隐藏
+            trend_sheet.column_dimensions[get_column_letter(len(self.TREND_HEADERS))].hidden = True
+        
+        trend_row = trend_sheet.max_row + 1
+        trend_sheet.cell(row=trend_row, column=1, value=sheet_name)
+        ratings = [
+            total_rating,
+            data['data']['best_rating'] / 100,
+            data['data']['best_new_rating'] / 100,
+            data['data']['hot_rating'] / 100,
+        ]
+        for column, value in enumerate(ratings, 2):
+            self.set_number_format(trend_sheet.cell(row=trend_row, column=column), value, is_rating=True)
+        trend_sheet.cell(row=trend_row, column=len(self.TREND_HEADERS), value=content_hash)
+        
+        workbook.save(history_file)
+        
+        logger.info(f"已追加快照工作表 {sheet_name} 到 {history_file}")
+        logger.info(f"玩家总Rating: {total_rating:.2f}")
+        return sheet_name
+
+def export_json(merged_data, output_file):
+    """导出合并后的JSON数据"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    return output_file
+
+def export_xlsx(merged_data, output_file):
+    """导出Excel文件"""
+    B50Converter().write_excel(merged_data, output_file)
+    return output_file
+
+def export_history(merged_data, output_file):
+    """追加到历史Excel文件"""
+    B50Converter().append_data_to_history(merged_data, output_file)
+    return output_file
+
+def export_image(merged_data, output_file, scale=1.0, layout='b55', **encode_options):
+    """导出B55图片，格式按扩展名判断，scale为渲染缩放比例，layout为图像布局，encode_options传给encode_image"""
+    from b55_gram import B55GramGenerator
+    generator = B55GramGenerator(scale=scale, layout=layout)
+    # 只在资源缺失或过期时访问网络
+    if generator.assets.needs_fetch(generator.jacket_store):
+        generator.fetch_assets()
+    # 数据和参数与上次相同时直接使用缓存的图片
+    result = generator.render_cached(merged_data["rating"], merged_data.get("profile"), output_file, **encode_options)
+    if result['cached']:
+        logger.info(f"使用缓存的图片: {result['format']}, {result['size'] / 1024:.0f} KB")
+    else:
+        logger.info(f"图片编码: {result['format']}, {result['size'] / 1024:.0f} KB, 耗时: {result['encode_time']:.2f}秒")
+    return output_file
+
+# 导出格式 -> 导出函数，新格式只需在此注册
+EXPORTERS = {
+    'json': export_json,
+    'xlsx': export_xlsx,
+    'history': export_history,
+    'image': export_image,
+}
+
+def run_exports(merged_data, targets, max_workers=None):
+    """
+    并发执行多个导出任务，各任务之间互不共享状态。
+    targets: [(格式, 输出文件), ...]，也可以是(格式, 输出文件, 选项)，选项作为关键字参数传给导出函数
+    返回每个任务的结果: {'format', 'output', 'elapsed', 'error'}
+    """
+    def run_one(fmt, output_file, options=None):
+        start_time = time.perf_counter()
+        error = None
+        try:
+            EXPORTERS[fmt](merged_data, output_file, **(options or {}))
+        except Exception as e:
+            error = e
+            logger.exception(f"[{fmt}] 导出 {output_file} 时出错")
+        return {
+            'format': fmt,
+            'output': output_file,
+            'elapsed': time.perf_counter() - start_time,
+            'error': error,
+        }
+    
+    if not targets:
+        return []
+    
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as executor:
+        futures = [executor.submit(run_one, *target) for target in targets]
+        results = [future.result() for future in futures]
+    
+    for result in results:
+        if result['error'] is None:
+            logger.info(f"[{result['format']}] 已生成 {result['output']}，耗时: {result['elapsed']:.2f}秒")
+        else:
+            logger.error(f"[{result['format']}] 生成 {result['output']} 失败: {result['error']}，耗时: {result['elapsed']:.2f}秒")
+    logger.info(f"导出完成，总耗时: {time.perf_counter() - start_time:.2f}秒")
+    return results
+
 def main():
     parser = argparse.ArgumentParser(description='获取ONGEKI评分数据')
     parser.add_argument('--email', help='bemanicn.com账号邮箱')
@@ -1088,6 +1189,12 @@ def main():
     parser.add_argument('--debug', action='store_true', help='开启详细调试信息')
     parser.add_argument('--no-proxy', action='store_true', help='禁用代理')
     parser.add_argument('--image', action='store_true', help='生成B55图片')
+    parser.add_argument('--image-output', default='b55_gram.png', help='B55图片文件名，格式按扩展名判断(.png/.webp/.jpg)')
+    parser.add_argument('--image-quality', type=int, help='WebP/JPEG图片质量(1-100)')
+    parser.add_argument('--image-compress-level', type=int, help='PNG压缩级别(0-9)，越小越快')
+    parser.add_argument('--image-scale', type=float, default=1.0, help='B55图片缩放比例，如0.5生成低分辨率预览')
+    parser.add_argument('--image-layout', choices=['b55', 'records'], default='b55', help='B55图片布局，records为所有游玩记录')
+    parser.add_argument('--history', help='追加快照到指定的历史Excel文件（每天一个工作表）')
     
     args = parser.parse_args()
     
@@ -1177,37 +1284,17 @@ def main():
         else:
             logger.warning("获取玩家资料失败")
     
-    # 保存合并后的数据到文件
-    try:
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
-        logger.info(f"数据已保存到 {args.output}")
-        save_success = True
-    except Exception as e:
-        logger.error(f"保存数据失败: {e}")
-        save_success = False
+    # 保存合并后的数据到文件（其他导出格式并发执行，互不依赖）
+    targets = [('json', args.output)]
+    if args.excel:
+        targets.append(('xlsx', os.path.splitext(args.output)[0] + '.xlsx'))
+    if args.history:
+        targets.append(('history', args.history))
+    if args.image:
+        encode_options = {'scale': args.image_scale, 'layout': args.image_layout, 'quality': args.image_quality, 'compress_level': args.image_compress_level}
+        targets.append(('image', args.image_output, encode_options))
     
-    if save_success and args.excel:
-        try:
-            excel_file = args.output.replace('.json', '.xlsx')
-            logger.info(f"转换为Excel文件: {excel_file}")
-            converter = B50Converter()
-            converter.convert_to_excel(args.output, excel_file)
-            logger.info(f"Excel文件已生成: {excel_file}")
-        except Exception as e:
-            logger.error(f"转换为Excel失败: {e}")
-    
-    if save_success and args.image:
-        try:
-            logger.info("开始生成B55图片...")
-            from b55_gram import B55GramGenerator
-            generator = B55GramGenerator()
-            image = generator.generate(rating_data, merged_data.get("profile"))
-            image.save('b55_gram.png')
-            logger.info("B55图片已生成: b55_gram.png")
-        except Exception as e:
-            logger.error(f"生成B55图片失败: {e}")
-            logger.error(traceback.format_exc())
+    run_exports(merged_data, targets)
     
     logger.info("操作完成")
 
@@ -0,0 +1,402 @@
+"""
+B55图片的黄金图像回归检查。
+
+用固定的输入数据（合成数据和golden/fixtures中匿名化的b50.json）、固定的字体和图标渲染，
+与golden/expected中保存的黄金图像比较：先逐像素比较，不一致时再按感知阈值判断，
+并在golden/diff中输出差异图。每个用例还会用多种渲染方式（线程池、进程池、条带、增量、缓存）
+分别渲染（增量渲染另有一种第一次渲染时缺少部分封面的情况），保证渲染优化不改变画面。全程离线，可以在CI中运行。
+
+    python golden.py update    # 在可信的版本上生成黄金图像
+    python golden.py check     # 检查当前代码的渲染结果，有失败时返回1
+
+golden/assets的结构与assets目录相同，随仓库提供的只有字体DejaVu Sans（生成器用到的各个字体名都使用它）。
+DejaVu Sans不含中日文字形，曲名中的中日文都显示为缺字方框，黄金图像不检查中日文字形的绘制；
+其余缺失的图标（ranks、diff_*.png、default_avatar.webp）在运行时用几何图形确定性地生成，
+也可以放入自己的图标和cover。资源复制到临时目录中，缓存也都写在临时目录中，不受本机assets和cache的影响
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from b55_gram import (AssetBundle, B55GramGenerator, CellTileCache, FontRegistry, JacketImageCache, JacketPack,
+                      JacketTileCache, RenderCache)
+from synthetic import song_lists
+
+# 以下为黄金图像的输入数据，与benchmark使用的synthetic.py分开、保持不变：
+# 任何修改都会使已有的黄金图像全部失效，需要同时重新运行update
+
+# 合成数据使用的歌曲名：英文、中日文（显示为缺字方框，只用于检查文字宽度的测量），以及超过20个字符、会被截断的长标题
+SYNTHETIC_NAMES = [
+    "Song", "テスト曲", "测试歌曲", "Brand New Day",
+    "A very long song title that will be truncated",
+    "とても長い曲名のテストケースです、省略されるはず",
+    "非常长的歌曲名称用于测试截断效果的情况",
+    "MIXED 混合 タイトル 123",
+]
+SYNTHETIC_DIFFICULTIES = [0, 1, 2, 3, 10]
+# 合成封面使用的music_id从这里开始，避免与真实封面冲突
+SYNTHETIC_ID_BASE = 900000
+
+def synthetic_song(rng, music_id):
+    """随机生成一条成绩，分数覆盖各个评级，rating覆盖各个颜色区间"""
+    return {
+        'music': {'music_id': music_id, 'name': rng.choice(SYNTHETIC_NAMES) + f" {music_id % 1000}"},
+        'difficulty': rng.choice(SYNTHETIC_DIFFICULTIES),
+        'score': rng.choice([rng.randint(500000, 1010000), rng.randint(1000000, 1010000)]),
+        'rating': rng.randint(100, 1750),
+    }
+
+def synthetic_payload(seed, best=30, new=15, recent=10, profile=True):
+    """生成一份b50数据，返回(rating数据, 玩家资料)"""
+    rng = random.Random(seed)
+    next_id = [SYNTHETIC_ID_BASE + seed * 1000]
+
+    def songs(count):
+        result = []
+        for _ in range(count):
+            result.append(synthetic_song(rng, next_id[0]))
+            next_id[0] += 1
+        return result
+
+    rating_data = {'data': {
+        'rating': rng.randint(1000, 1700),
+        'best_rating': rng.randint(1000, 1700),
+        'best_new_rating': rng.randint(1000, 1700),
+        'hot_rating': rng.randint(1000, 1700),
+        'best_rating_list': songs(best),
+        'best_new_rating_list': songs(new),
+        'hot_rating_list': songs(recent),
+    }}
+    player_data = None
+    if profile:
+        player_data = {'data': {
+            'user_name': rng.choice(["Tester", "テスター", "测试玩家"]),
+            'level': rng.randint(1, 99),
+            'player_rating': rating_data['data']['rating'],
+            'reincarnation_num': rng.randint(0, 3),
+            'avatar_path': None,
+        }}
+    return rating_data, player_data
+
+def synthetic_jacket(music_id):
+    """按music_id确定性地生成封面：渐变背景加几何图形，部分封面不是正方形"""
+    rng = random.Random(music_id)
+    size = rng.choice([(300, 300), (400, 300), (300, 400)])
+    start = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+    end = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+    t = np.linspace(0, 1, size[0], dtype=np.float32)[None, :, None]
+    pixels = np.broadcast_to(start + (end - start) * t, (size[1], size[0], 3)).astype(np.uint8)
+    jacket = Image.fromarray(pixels, 'RGB')
+    draw = ImageDraw.Draw(jacket)
+    for _ in range(4):
+        x, y = rng.randint(0, size[0]), rng.randint(0, size[1])
+        r = rng.randint(20, 120)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    buffer = io.BytesIO()
+    jacket.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def synthetic_cases():
+    """合成用例：用例名 -> {'rating', 'profile', 'layout', 'scale'}"""
+    cases = {}
+    def add(name, seed, layout='b55', scale=1.0, **counts):
+        rating_data, player_data = synthetic_payload(seed, **counts)
+        cases[name] = {'rating': rating_data, 'profile': player_data, 'layout': layout, 'scale': scale}
+    add('synthetic_full', 1)
+    add('synthetic_partial', 2, best=7, new=3, recent=0)
+    add('synthetic_no_profile', 3, profile=False)
+    add('synthetic_empty', 4, best=0, new=0, recent=0)
+    add('synthetic_preview', 5, scale=0.5)
+    add('synthetic_records', 6, layout='records', best=90, new=25, recent=10)
+    return cases
+
+def fixture_cases(fixtures_dir):
+    """golden/fixtures中的b50.json（get_rating.py保存的格式，玩家信息已匿名化），每个文件一个用例"""
+    cases = {}
+    if not os.path.isdir(fixtures_dir):
+        return cases
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(fixtures_dir, file_name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            cases[os.path.splitext(file_name)[0]] = {'rating': data['rating'], 'profile': data.get('profile'),
+                                                     'layout': 'b55', 'scale': 1.0}
+    return cases
+
+def tweaked_payload(rating_data):
+    """修改部分成绩后的数据，用于让增量渲染从不同的上一张图开始"""
+    tweaked = json.loads(json.dumps(rating_data))
+    for key in ('best_rating_list', 'best_new_rating_list', 'hot_rating_list'):
+        for i, song in enumerate(tweaked['data'][key]):
+            if i % 3 == 0:
+                song['score'] = max(0, song['score'] - 1234)
+    return tweaked
+
+# 随仓库提供的字体，生成器按平台使用的各个字体名都指向它
+GOLDEN_FONT = 'DejaVuSans.ttf'
+FONT_ALIASES = ['combined.ttf', 'Torus-SemiBold.otf', 'BIZ-UDGOTHICB.TTC', 'NotoSansCJK-Regular.ttc', 'PingFang.ttc']
+
+def generate_assets(assets_dir):
+    """补全缺失的字体别名和图标，已存在的文件不覆盖。图标只用几何图形绘制，不依赖字体"""
+    fonts_dir = os.path.join(assets_dir, 'fonts')
+    for name in FONT_ALIASES:
+        if not os.path.exists(os.path.join(fonts_dir, name)):
+            shutil.copyfile(os.path.join(fonts_dir, GOLDEN_FONT), os.path.join(fonts_dir, name))
+    
+    bundle = AssetBundle(assets_dir)
+    for i, diff_type in enumerate(AssetBundle.DIFFICULTY_TYPES):
+        path = bundle.difficulty_path(diff_type)
+        if not os.path.exists(path):
+            icon = Image.new('RGBA', (116, 15), (60 + 40 * i, 200 - 30 * i, 90 + 30 * i, 255))
+            ImageDraw.Draw(icon).rectangle((4, 4, 4 + 20 * i, 10), fill=(255, 255, 255, 255))
+            icon.save(path)
+    
+    os.makedirs(os.path.join(assets_dir, 'ranks'), exist_ok=True)
+    for i, rank in enumerate(AssetBundle.RANK_MAP.values()):
+        path = bundle.rank_path(rank)
+        if not os.path.exists(path):
+            icon = Image.new('RGBA', (50, 25), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(icon)
+            draw.rounded_rectangle((0, 0, 49, 24), radius=6, fill=(20 * i, 240 - 20 * i, 120, 220))
+            for bar in range(len(AssetBundle.RANK_MAP) - i):
+                draw.rectangle((4 + bar * 4, 8, 5 + bar * 4, 16), fill=(255, 255, 255, 255))
+            icon.save(path)
+    
+    avatar_path = os.path.join(assets_dir, 'default_avatar.webp')
+    if not os.path.exists(avatar_path):
+        avatar = Image.new('RGB', (100, 100), (200, 200, 200))
+        ImageDraw.Draw(avatar).ellipse((10, 10, 90, 90), fill=(150, 150, 150))
+        avatar.save(avatar_path, format='WEBP', lossless=True)
+
+class GoldenRenderer:
+    """在隔离的临时目录中渲染用例，每种渲染方式使用各自的空缓存"""
+    def __init__(self, golden_dir):
+        self.golden_dir = os.path.abspath(golden_dir)
+        assets_dir = os.path.join(self.golden_dir, 'assets')
+        if not os.path.exists(os.path.join(assets_dir, 'fonts', GOLDEN_FONT)):
+            raise SystemExit(f"Missing {os.path.join(assets_dir, 'fonts', GOLDEN_FONT)}: the golden images are rendered with this font")
+        self.work_dir = tempfile.mkdtemp(prefix='b55-golden-')
+        self.previous_dir = os.getcwd()
+        shutil.copytree(assets_dir, os.path.join(self.work_dir, 'assets'))
+        generate_assets(os.path.join(self.work_dir, 'assets'))
+        os.chdir(self.work_dir)
+        # 只使用复制过来的字体，不回退到系统字体
+        FontRegistry.configure([os.path.join(self.work_dir, 'assets', 'fonts')])
+        self.jacket_store = JacketPack('assets/covers.pack', import_dir='assets/cover')
+
+    def add_synthetic_jackets(self, cases):
+        for case in cases.values():
+            for song in song_lists(case['rating']):
+                music_id = song['music']['music_id']
+                if isinstance(music_id, int) and music_id >= SYNTHETIC_ID_BASE and music_id not in self.jacket_store:
+                    self.jacket_store.append(music_id, synthetic_jacket(music_id))
+
+    def generator(self, case, variant, cell_cache=None, jacket_store=None, **options):
+        cache_dir = os.path.join('cache', variant)
+        if cell_cache is None:
+            cell_cache = CellTileCache(max_memory_bytes=0)
+        return B55GramGenerator(tile_cache=JacketTileCache(cache_dir=os.path.join(cache_dir, 'tiles')),
+                                cell_cache=cell_cache, jacket_store=jacket_store or self.jacket_store,
+                                jacket_cache=JacketImageCache(), render_cache=RenderCache(os.path.join(cache_dir, 'renders')),
+                                offline=True, scale=case['scale'], layout=case['layout'], **options)
+
+    def render(self, case, variant):
+        """按指定的渲染方式渲染用例"""
+        rating_data, player_data = case['rating'], case['profile']
+        if variant == 'serial':
+            generator = self.generator(case, variant)
+        elif variant == 'threads':
+            generator = self.generator(case, variant, render_workers=3)
+        elif variant == 'process':
+            generator = self.generator(case, variant, render_workers=2, render_pool='process')
+        elif variant == 'incremental':
+            generator = self.generator(case, variant, incremental=True)
+            generator.generate(tweaked_payload(rating_data), player_data)
+        elif variant == 'warm':
+            # 第二次渲染时单元格图块、背景、模板层都来自缓存
+            generator = self.generator(case, variant, cell_cache=CellTileCache())
+            generator.generate(rating_data, player_data)
+        elif variant == 'late_jackets':
+            return self.render_late_jackets(case)
+        elif variant == 'strips':
+            generator = self.generator(case, variant)
+            try:
+                strips = generator.generate_strips(rating_data, player_data, strip_height=generator.px(333))
+                image = Image.new('RGB', next(strips))
+                for top, strip in strips:
+                    image.paste(strip, (0, top))
+                return image
+            finally:
+                generator.close()
+        else:
+            raise ValueError(f"Unknown variant: {variant}")
+        try:
+            return generator.generate(rating_data, player_data).copy()
+        finally:
+            generator.close()
+
+    def render_late_jackets(self, case):
+        """
+        增量渲染，第一次渲染时缺少三分之一的封面（使用默认封面），
+        封面追加到封面包后再次渲染，这些格子应当重绘；每次增量渲染都与完整渲染比较
+        """
+        rating_data, player_data = case['rating'], case['profile']
+        music_ids = sorted({str(song['music']['music_id']) for song in song_lists(rating_data)})
+        late = set(music_ids[::3])
+        jacket_store = JacketPack(os.path.join('cache', 'late_jackets', 'covers.pack'), import_dir=None)
+        for key in self.jacket_store.keys():
+            if key not in late:
+                jacket_store.append(key, self.jacket_store.read(key))
+        generator = self.generator(case, 'late_jackets', jacket_store=jacket_store, incremental=True, verify_incremental=True)
+        try:
+            generator.generate(rating_data, player_data)
+            for key in sorted(late):
+                data = self.jacket_store.read(key)
+                if data is not None:
+                    jacket_store.append(key, data)
+            return generator.generate(rating_data, player_data).copy()
+        finally:
+            generator.close()
+            jacket_store.close()
+
+    def close(self):
+        self.jacket_store.close()
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+VARIANTS = ['serial', 'threads', 'process', 'strips', 'incremental', 'late_jackets', 'warm']
+
+def compare_images(expected, actual, threshold=24, max_ratio=0.0005):
+    """
+    比较两张图片。先逐像素比较；不一致时两张图各做3x3均值模糊（容忍抗锯齿的亚像素偏移），
+    统计任一通道差值超过threshold的像素比例，不超过max_ratio时视为感知上一致。
+    返回: {'status': 'exact'/'perceptual'/'fail', 'max_diff', 'changed', 'ratio', 'reason'}
+    """
+    if expected.size != actual.size:
+        return {'status': 'fail', 'max_diff': None, 'changed': None, 'ratio': None,
+                'reason': f"size {actual.size} != {expected.size}"}
+    a = np.asarray(expected.convert('RGB'), dtype=np.int16)
+    b = np.asarray(actual.convert('RGB'), dtype=np.int16)
+    diff = np.abs(a - b).max(axis=2)
+    changed = int(np.count_nonzero(diff))
+    if not changed:
+        return {'status': 'exact', 'max_diff': 0, 'changed': 0, 'ratio': 0.0, 'reason': None}
+    blurred_a = np.asarray(expected.convert('RGB').filter(ImageFilter.BoxBlur(1)), dtype=np.int16)
+    blurred_b = np.asarray(actual.convert('RGB').filter(ImageFilter.BoxBlur(1)), dtype=np.int16)
+    ratio = float(np.count_nonzero(np.abs(blurred_a - blurred_b).max(axis=2) > threshold)) / diff.size
+    return {'status': 'perceptual' if ratio <= max_ratio else 'fail', 'max_diff': int(diff.max()),
+            'changed': changed, 'ratio': ratio, 'reason': None}
+
+def diff_image(expected, actual):
+    """差异图：黄金图像 | 当前结果 | 差异（灰度底图上用红色标出不一致的像素，差值越大越亮）"""
+    width, height = expected.size
+    a = np.asarray(expected.convert('RGB'), dtype=np.int16)
+    b = np.asarray(actual.convert('RGB'), dtype=np.int16)
+    diff = np.abs(a - b).max(axis=2)
+    base = (np.asarray(expected.convert('L'), dtype=np.float32) * 0.3).astype(np.uint8)
+    heat = np.stack([base, base, base], axis=2)
+    mask = diff > 0
+    heat[mask] = np.stack([np.clip(128 + diff[mask] * 4, 0, 255), np.zeros_like(diff[mask]), np.zeros_like(diff[mask])], axis=1)
+    canvas = Image.new('RGB', (width * 3, height))
+    canvas.paste(expected.convert('RGB'), (0, 0))
+    canvas.paste(actual.convert('RGB'), (width, 0))
+    canvas.paste(Image.fromarray(heat.astype(np.uint8), 'RGB'), (width * 2, 0))
+    return canvas
+
+def load_cases(golden_dir, names=None):
+    cases = synthetic_cases()
+    cases.update(fixture_cases(os.path.join(golden_dir, 'fixtures')))
+    if names:
+        missing = [name for name in names if name not in cases]
+        if missing:
+            raise SystemExit(f"Unknown cases: {', '.join(missing)}")
+        cases = {name: cases[name] for name in names}
+    return cases
+
+def update(golden_dir, cases):
+    """用串行渲染的结果生成黄金图像"""
+    expected_dir = os.path.join(os.path.abspath(golden_dir), 'expected')
+    os.makedirs(expected_dir, exist_ok=True)
+    renderer = GoldenRenderer(golden_dir)
+    try:
+        renderer.add_synthetic_jackets(cases)
+        for name, case in cases.items():
+            image = renderer.render(case, 'serial')
+            image.save(os.path.join(expected_dir, f"{name}.png"), format='PNG', compress_level=9)
+            print(f"{name:<28} {image.size[0]}x{image.size[1]} updated")
+    finally:
+        renderer.close()
+
+def check(golden_dir, cases, variants, threshold, max_ratio, exact):
+    """检查所有用例和渲染方式，返回失败的数量"""
+    golden_dir = os.path.abspath(golden_dir)
+    expected_dir = os.path.join(golden_dir, 'expected')
+    diff_dir = os.path.join(golden_dir, 'diff')
+    failures = 0
+    renderer = GoldenRenderer(golden_dir)
+    try:
+        renderer.add_synthetic_jackets(cases)
+        print(f"{'用例':<26} {'渲染方式':<8} {'结果':<16} {'不同像素':>6} {'最大差值':>6}")
+        for name, case in cases.items():
+            expected_path = os.path.join(expected_dir, f"{name}.png")
+            if not os.path.exists(expected_path):
+                print(f"{name:<28} {'-':<12} missing golden image, run 'python golden.py update'")
+                failures += 1
+                continue
+            with Image.open(expected_path) as img:
+                expected = img.convert('RGB')
+            for variant in variants:
+                actual = renderer.render(case, variant)
+                result = compare_images(expected, actual, threshold, max_ratio)
+                failed = result['status'] == 'fail' or (exact and result['status'] != 'exact')
+                if failed:
+                    failures += 1
+                if result['status'] != 'exact':
+                    # 保存当前结果和差异图，便于查看
+                    os.makedirs(diff_dir, exist_ok=True)
+                    actual.save(os.path.join(diff_dir, f"{name}-{variant}-actual.png"))
+                    if result['reason'] is None:
+                        diff_image(expected, actual).save(os.path.join(diff_dir, f"{name}-{variant}-diff.png"))
+                # 失败的结果用大写显示
+                status = result['status'].upper() if failed else result['status']
+                if result['reason']:
+                    status += f" ({result['reason']})"
+                changed = '-' if result['changed'] is None else result['changed']
+                max_diff = '-' if result['max_diff'] is None else result['max_diff']
+                print(f"{name:<28} {variant:<12} {status:<18} {changed:>10} {max_diff:>10}")
+    finally:
+        renderer.close()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='B55图片黄金图像回归检查')
+    parser.add_argument('command', choices=['check', 'update'], help='check: 与黄金图像比较; update: 重新生成黄金图像')
+    parser.add_argument('--golden-dir', default='golden', help='黄金图像目录，包含assets、fixtures、expected')
+    parser.add_argument('--case', action='append', help='只运行指定的用例，可重复')
+    parser.add_argument('--variant', action='append', choices=VARIANTS, help='只检查指定的渲染方式，可重复')
+    parser.add_argument('--threshold', type=int, default=24, help='感知比较中视为不同的通道差值')
+    parser.add_argument('--max-ratio', type=float, default=0.0005, help='感知比较中允许不同的像素比例')
+    parser.add_argument('--exact', action='store_true', help='要求逐像素一致，感知上一致也视为失败')
+    args = parser.parse_args()
+
+    cases = load_cases(args.golden_dir, args.case)
+    if args.command == 'update':
+        update(args.golden_dir, cases)
+        return
+    failures = check(args.golden_dir, cases, args.variant or VARIANTS, args.threshold, args.max_ratio, args.exact)
+    print(f"{failures} failure(s)" if failures else "All golden images match")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+合成测试数据：任意数量成绩的b50数据和确定性的封面，供benchmark.py和golden.py使用。
+相同的种子总是生成相同的数据
+"""
+import io
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# 随机歌曲名使用的字符：英文、假名和常用汉字
+LATIN_WORDS = ["Song", "Brand", "New", "Day", "Night", "Dream", "Star", "Light", "Remix", "Extended", "feat.", "Ver."]
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのアイウエオカキクケコサシスセソタチツテトナニヌネノー"
+HANZI = "春夏秋冬风花雪月星空海天光影梦想歌曲测试长名称世界未来青色白黑红心爱恋夜明日"
+SYNTHETIC_DIFFICULTIES = [0, 1, 2, 3, 10]
+# 合成封面使用的music_id从这里开始，避免与真实封面冲突
+SYNTHETIC_ID_BASE = 900000
+
+def synthetic_name(rng):
+    """随机歌曲名：约四成超过20个字符，会被单元格截断"""
+    length = rng.randint(21, 48) if rng.random() < 0.4 else rng.randint(2, 16)
+    kind = rng.choice(['latin', 'kana', 'hanzi', 'mixed'])
+    if kind == 'latin':
+        words = []
+        while len(" ".join(words)) < length:
+            words.append(rng.choice(LATIN_WORDS))
+        return " ".join(words)[:length]
+    alphabet = {'kana': KANA, 'hanzi': HANZI, 'mixed': KANA + HANZI + "ABCXYZ 0123456789"}[kind]
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+def synthetic_song(rng, music_id):
+    """随机生成一条成绩，分数覆盖各个评级，rating覆盖各个颜色区间"""
+    return {
+        'music': {'music_id': music_id, 'name': synthetic_name(rng)},
+        'difficulty': rng.choice(SYNTHETIC_DIFFICULTIES),
+        'score': rng.choice([rng.randint(500000, 1010000), rng.randint(1000000, 1010000)]),
+        'rating': rng.randint(100, 1750),
+    }
+
+def synthetic_payload(seed, best=30, new=15, recent=10, profile=True):
+    """
+    生成一份b50数据，各列表的长度任意，music_id互不相同。
+    返回(rating数据, 玩家资料)，结构与b50.json中的rating和profile相同
+    """
+    rng = random.Random(seed)
+    next_id = [SYNTHETIC_ID_BASE + seed * 100000]
+
+    def songs(count):
+        result = []
+        for _ in range(count):
+            result.append(synthetic_song(rng, next_id[0]))
+            next_id[0] += 1
+        return result
+
+    rating_data = {'data': {
+        'rating': rng.randint(1000, 1700),
+        'best_rating': rng.randint(1000, 1700),
+        'best_new_rating': rng.randint(1000, 1700),
+        'hot_rating': rng.randint(1000, 1700),
+        'best_rating_list': songs(best),
+        'best_new_rating_list': songs(new),
+        'hot_rating_list': songs(recent),
+    }}
+    player_data = None
+    if profile:
+        player_data = {'data': {
+            'user_name': synthetic_name(rng)[:12],
+            'level': rng.randint(1, 99),
+            'player_rating': rating_data['data']['rating'],
+            'reincarnation_num': rng.randint(0, 3),
+            'avatar_path': None,
+        }}
+    return rating_data, player_data
+
+def synthetic_jacket(seed, fmt='PNG'):
+    """按种子确定性地生成封面：渐变背景加几何图形，部分封面不是正方形，返回编码后的字节"""
+    rng = random.Random(seed)
+    size = rng.choice([(300, 300), (400, 300), (300, 400)])
+    start = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+    end = np.array([rng.randint(0, 255) for _ in range(3)], dtype=np.float32)
+    t = np.linspace(0, 1, size[0], dtype=np.float32)[None, :, None]
+    pixels = np.broadcast_to(start + (end - start) * t, (size[1], size[0], 3)).astype(np.uint8)
+    jacket = Image.fromarray(pixels, 'RGB')
+    draw = ImageDraw.Draw(jacket)
+    for _ in range(4):
+        x, y = rng.randint(0, size[0]), rng.randint(0, size[1])
+        r = rng.randint(20, 120)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    buffer = io.BytesIO()
+    jacket.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+def song_lists(rating_data):
+    """rating数据中的所有成绩"""
+    data = rating_data['data']
+    return data['best_rating_list'] + data['best_new_rating_list'] + data['hot_rating_list']